@@ -3,10 +3,11 @@ from aiogram import Bot, types
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 from aiogram.utils.keyboard import InlineKeyboardBuilder
-import database
+import storage
 import user
 import keyboards
-import asyncio
+import delivery
+import broadcast
 import subprocess
 import os
 import sys
@@ -19,9 +20,9 @@ class AdminPermState(StatesGroup):
 
 async def handle_report(message: types.Message, bot: Bot):
     user_id = message.from_user.id
-    user_data = database.get_user(user_id)
+    user_data = await storage.db.get_user(user_id)
     
-    if not user_data or not user_data['captcha_passed']:
+    if not user_data or not user_data.captcha_passed:
         await user.send_captcha(message, bot)
         return
     
@@ -39,7 +40,7 @@ async def handle_report(message: types.Message, bot: Bot):
     replied_message_id = message.reply_to_message.message_id
     reporter_id = message.from_user.id
     
-    result = database.get_original_message_info(replied_message_id, reporter_id)
+    result = await storage.db.get_original_message_info(replied_message_id, reporter_id)
     
     if not result:
         await message.answer("Сообщение не найдено!", 
@@ -48,14 +49,14 @@ async def handle_report(message: types.Message, bot: Bot):
     
     original_message_id, original_sender_id = result
     
-    admins = database.get_admin_users()
+    admins = await storage.db.get_admin_users()
     
     sent_count = 0
     for admin_id in admins:
         if admin_id == reporter_id:
             continue
         
-        admin_message = database.get_message_map(original_message_id, admin_id)
+        admin_message = await storage.db.get_message_map(original_message_id, admin_id)
         
         if admin_message:
             try:
@@ -78,13 +79,13 @@ async def handle_report(message: types.Message, bot: Bot):
 
 async def handle_ban(message: types.Message, bot: Bot):
     user_id = message.from_user.id
-    user_data = database.get_user(user_id)
+    user_data = await storage.db.get_user(user_id)
     
-    if not user_data or not user_data['captcha_passed']:
+    if not user_data or not user_data.captcha_passed:
         await user.send_captcha(message, bot)
         return
     
-    if not user.is_admin(user_id):
+    if not await user.is_admin(user_id):
         await user.send_access_denied(user_id, bot)
         return
     
@@ -103,7 +104,7 @@ async def handle_ban(message: types.Message, bot: Bot):
     replied_message_id = message.reply_to_message.message_id
     admin_id = message.from_user.id
     
-    result = database.get_original_message_info(replied_message_id, admin_id)
+    result = await storage.db.get_original_message_info(replied_message_id, admin_id)
     
     if not result:
         await message.answer("Не удалось найти автора сообщения!", 
@@ -117,8 +118,8 @@ async def handle_ban(message: types.Message, bot: Bot):
                              reply_markup=keyboards.create_system_keyboard())
         return
     
-    database.update_user(target_user_id, {'banned': 1})
-    database.add_warning(target_user_id, admin_id, f"Бан: {reason}")
+    await storage.db.update_user(target_user_id, {'banned': 1})
+    await storage.db.add_warning(target_user_id, admin_id, f"Бан: {reason}")
     
     await message.answer(f"Пользователь забанен. Причина: {reason}", 
                          reply_markup=keyboards.create_system_keyboard())
@@ -131,13 +132,13 @@ async def handle_ban(message: types.Message, bot: Bot):
 
 async def handle_unban(message: types.Message, bot: Bot):
     user_id = message.from_user.id
-    user_data = database.get_user(user_id)
+    user_data = await storage.db.get_user(user_id)
     
-    if not user_data or not user_data['captcha_passed']:
+    if not user_data or not user_data.captcha_passed:
         await user.send_captcha(message, bot)
         return
     
-    if not user.is_admin(user_id):
+    if not await user.is_admin(user_id):
         await user.send_access_denied(user_id, bot)
         return
     
@@ -149,7 +150,7 @@ async def handle_unban(message: types.Message, bot: Bot):
     replied_message_id = message.reply_to_message.message_id
     admin_id = message.from_user.id
     
-    result = database.get_original_message_info(replied_message_id, admin_id)
+    result = await storage.db.get_original_message_info(replied_message_id, admin_id)
     
     if not result:
         await message.answer("Не удалось найти автора сообщения!", 
@@ -158,7 +159,7 @@ async def handle_unban(message: types.Message, bot: Bot):
     
     target_user_id = result[1]
     
-    database.update_user(target_user_id, {'banned': 0})
+    await storage.db.update_user(target_user_id, {'banned': 0})
     
     await message.answer("Пользователь разбанен", 
                          reply_markup=keyboards.create_system_keyboard())
@@ -171,13 +172,13 @@ async def handle_unban(message: types.Message, bot: Bot):
 
 async def handle_mute(message: types.Message, bot: Bot):
     user_id = message.from_user.id
-    user_data = database.get_user(user_id)
+    user_data = await storage.db.get_user(user_id)
     
-    if not user_data or not user_data['captcha_passed']:
+    if not user_data or not user_data.captcha_passed:
         await user.send_captcha(message, bot)
         return
     
-    if not user.is_admin(user_id):
+    if not await user.is_admin(user_id):
         await user.send_access_denied(user_id, bot)
         return
     
@@ -203,7 +204,7 @@ async def handle_mute(message: types.Message, bot: Bot):
     replied_message_id = message.reply_to_message.message_id
     admin_id = message.from_user.id
     
-    result = database.get_original_message_info(replied_message_id, admin_id)
+    result = await storage.db.get_original_message_info(replied_message_id, admin_id)
     
     if not result:
         await message.answer("Не удалось найти автора сообщения!", 
@@ -220,8 +221,8 @@ async def handle_mute(message: types.Message, bot: Bot):
     from datetime import datetime, timedelta
     muted_until = datetime.now() + timedelta(minutes=mute_minutes)
     
-    database.update_user(target_user_id, {'muted_until': muted_until})
-    database.add_warning(target_user_id, admin_id, f"Мут на {mute_minutes} мин: {reason}")
+    await storage.db.update_user(target_user_id, {'muted_until': muted_until})
+    await storage.db.add_warning(target_user_id, admin_id, f"Мут на {mute_minutes} мин: {reason}")
     
     await message.answer(f"Пользователь замучен на {mute_minutes} минут\nПричина: {reason}", 
                          reply_markup=keyboards.create_system_keyboard())
@@ -234,13 +235,13 @@ async def handle_mute(message: types.Message, bot: Bot):
 
 async def handle_unmute(message: types.Message, bot: Bot):
     user_id = message.from_user.id
-    user_data = database.get_user(user_id)
+    user_data = await storage.db.get_user(user_id)
     
-    if not user_data or not user_data['captcha_passed']:
+    if not user_data or not user_data.captcha_passed:
         await user.send_captcha(message, bot)
         return
     
-    if not user.is_admin(user_id):
+    if not await user.is_admin(user_id):
         await user.send_access_denied(user_id, bot)
         return
     
@@ -252,7 +253,7 @@ async def handle_unmute(message: types.Message, bot: Bot):
     replied_message_id = message.reply_to_message.message_id
     admin_id = message.from_user.id
     
-    result = database.get_original_message_info(replied_message_id, admin_id)
+    result = await storage.db.get_original_message_info(replied_message_id, admin_id)
     
     if not result:
         await message.answer("Не удалось найти автора сообщения!", 
@@ -261,7 +262,7 @@ async def handle_unmute(message: types.Message, bot: Bot):
     
     target_user_id = result[1]
     
-    database.update_user(target_user_id, {'muted_until': None})
+    await storage.db.update_user(target_user_id, {'muted_until': None})
     
     await message.answer("Мут снят", reply_markup=keyboards.create_system_keyboard())
     
@@ -273,13 +274,13 @@ async def handle_unmute(message: types.Message, bot: Bot):
 
 async def handle_delete(message: types.Message, bot: Bot):
     user_id = message.from_user.id
-    user_data = database.get_user(user_id)
+    user_data = await storage.db.get_user(user_id)
     
-    if not user_data or not user_data['captcha_passed']:
+    if not user_data or not user_data.captcha_passed:
         await user.send_captcha(message, bot)
         return
     
-    if not user.is_admin(user_id):
+    if not await user.is_admin(user_id):
         await user.send_access_denied(user_id, bot)
         return
     
@@ -291,7 +292,7 @@ async def handle_delete(message: types.Message, bot: Bot):
     replied_message_id = message.reply_to_message.message_id
     admin_id = message.from_user.id
     
-    result = database.get_original_message_info(replied_message_id, admin_id)
+    result = await storage.db.get_original_message_info(replied_message_id, admin_id)
     
     if not result:
         await message.answer("Не удалось найти сообщение в базе!", 
@@ -300,30 +301,25 @@ async def handle_delete(message: types.Message, bot: Bot):
     
     original_message_id = result[0]
     
-    messages = database.get_messages_by_original(original_message_id)
+    messages = await storage.db.get_messages_by_original(original_message_id)
     
-    deleted_count = 0
-    for target_user_id, msg_id, msg_type, content in messages:
-        try:
-            await bot.delete_message(target_user_id, msg_id)
-            deleted_count += 1
-        except:
-            pass
+    deleted_count = await delivery.delete_messages(bot, ((target_user_id, msg_id) for target_user_id, msg_id, _, _ in messages),
+                                                   f"Delete {original_message_id}")
     
-    database.delete_messages_by_original(original_message_id)
+    await storage.db.delete_messages_by_original(original_message_id)
     
     await message.answer(f"Сообщение удалено у {deleted_count} пользователей", 
                          reply_markup=keyboards.create_system_keyboard())
 
 async def handle_warn(message: types.Message, bot: Bot):
     user_id = message.from_user.id
-    user_data = database.get_user(user_id)
+    user_data = await storage.db.get_user(user_id)
     
-    if not user_data or not user_data['captcha_passed']:
+    if not user_data or not user_data.captcha_passed:
         await user.send_captcha(message, bot)
         return
     
-    if not user.is_admin(user_id):
+    if not await user.is_admin(user_id):
         await user.send_access_denied(user_id, bot)
         return
     
@@ -342,7 +338,7 @@ async def handle_warn(message: types.Message, bot: Bot):
     replied_message_id = message.reply_to_message.message_id
     admin_id = message.from_user.id
     
-    result = database.get_original_message_info(replied_message_id, admin_id)
+    result = await storage.db.get_original_message_info(replied_message_id, admin_id)
     
     if not result:
         await message.answer("Не удалось найти автора сообщения!", 
@@ -351,17 +347,17 @@ async def handle_warn(message: types.Message, bot: Bot):
     
     target_user_id = result[1]
     
-    database.add_warning(target_user_id, admin_id, reason)
+    await storage.db.add_warning(target_user_id, admin_id, reason)
     
-    target_user = database.get_user(target_user_id)
+    target_user = await storage.db.get_user(target_user_id)
     if target_user:
-        new_warnings = target_user['warnings'] + 1
-        database.update_user(target_user_id, {'warnings': new_warnings})
+        new_warnings = target_user.warnings + 1
+        await storage.db.update_user(target_user_id, {'warnings': new_warnings})
         
         if new_warnings >= 3:
-            database.update_user(target_user_id, {'banned': 1})
+            await storage.db.update_user(target_user_id, {'banned': 1})
     
-    if target_user and target_user['warnings'] >= 3:
+    if target_user and target_user.warnings >= 3:
         try:
             await bot.send_message(target_user_id, "Вы получили 3ье предупреждение. Ваш аккаунт заблокирован по причине получения большого количества предупреждений", 
                                    reply_markup=keyboards.create_system_keyboard())
@@ -382,13 +378,13 @@ async def handle_warn(message: types.Message, bot: Bot):
 
 async def handle_unwarn(message: types.Message, bot: Bot):
     user_id = message.from_user.id
-    user_data = database.get_user(user_id)
+    user_data = await storage.db.get_user(user_id)
     
-    if not user_data or not user_data['captcha_passed']:
+    if not user_data or not user_data.captcha_passed:
         await user.send_captcha(message, bot)
         return
     
-    if not user.is_admin(user_id):
+    if not await user.is_admin(user_id):
         await user.send_access_denied(user_id, bot)
         return
     
@@ -400,7 +396,7 @@ async def handle_unwarn(message: types.Message, bot: Bot):
     replied_message_id = message.reply_to_message.message_id
     admin_id = message.from_user.id
     
-    result = database.get_original_message_info(replied_message_id, admin_id)
+    result = await storage.db.get_original_message_info(replied_message_id, admin_id)
     
     if not result:
         await message.answer("Не удалось найти автора сообщения!", 
@@ -409,12 +405,11 @@ async def handle_unwarn(message: types.Message, bot: Bot):
     
     target_user_id = result[1]
     
-    target_user = database.get_user(target_user_id)
-    if target_user and target_user['warnings'] > 0:
-        database.update_user(target_user_id, {'warnings': target_user['warnings'] - 1})
+    target_user = await storage.db.get_user(target_user_id)
+    if target_user and target_user.warnings > 0:
+        await storage.db.update_user(target_user_id, {'warnings': target_user.warnings - 1})
     
-    database.cursor.execute('DELETE FROM warnings WHERE user_id = ? AND id = (SELECT MAX(id) FROM warnings WHERE user_id = ?)', (target_user_id, target_user_id))
-    database.conn.commit()
+    await storage.db.remove_last_warning(target_user_id)
     
     await message.answer("Предупреждение снято", reply_markup=keyboards.create_system_keyboard())
     
@@ -426,13 +421,13 @@ async def handle_unwarn(message: types.Message, bot: Bot):
 
 async def handle_newadmin(message: types.Message, state: FSMContext, bot: Bot):
     user_id = message.from_user.id
-    user_data = database.get_user(user_id)
+    user_data = await storage.db.get_user(user_id)
     
-    if not user_data or not user_data['captcha_passed']:
+    if not user_data or not user_data.captcha_passed:
         await user.send_captcha(message, bot)
         return
     
-    if not user.is_creator(user_id):
+    if not await user.is_creator(user_id):
         await user.send_access_denied(user_id, bot)
         return
     
@@ -444,7 +439,7 @@ async def handle_newadmin(message: types.Message, state: FSMContext, bot: Bot):
     replied_message_id = message.reply_to_message.message_id
     creator_id = message.from_user.id
     
-    result = database.get_original_message_info(replied_message_id, creator_id)
+    result = await storage.db.get_original_message_info(replied_message_id, creator_id)
     
     if not result:
         await message.answer("Не удалось найти автора сообщения!", 
@@ -479,12 +474,7 @@ async def handle_admin_perm_callback(query: types.CallbackQuery, state: FSMConte
     if query.data == "perm_confirm":
         await state.clear()
         
-        if not database.get_user(new_admin_id):
-            database.cursor.execute('INSERT INTO users (user_id, is_admin) VALUES (?, 1)', (new_admin_id,))
-        else:
-            database.update_user(new_admin_id, {'is_admin': 1})
-        
-        database.conn.commit()
+        await storage.db.grant_role(new_admin_id, 'is_admin')
         
         await query.message.edit_text(f"Пользователь назначен администратором!")
         
@@ -506,12 +496,7 @@ async def handle_admin_perm_callback(query: types.CallbackQuery, state: FSMConte
     if query.data == "perm_coowner":
         await state.clear()
         
-        if not database.get_user(new_admin_id):
-            database.cursor.execute('INSERT INTO users (user_id, is_coowner) VALUES (?, 1)', (new_admin_id,))
-        else:
-            database.update_user(new_admin_id, {'is_coowner': 1})
-        
-        database.conn.commit()
+        await storage.db.grant_role(new_admin_id, 'is_coowner')
         
         await query.message.edit_text(f"Пользователь {new_admin_id} назначен Co-Owner!")
         
@@ -566,13 +551,13 @@ async def handle_admin_perm_callback(query: types.CallbackQuery, state: FSMConte
 
 async def handle_banadmin(message: types.Message, bot: Bot):
     user_id = message.from_user.id
-    user_data = database.get_user(user_id)
+    user_data = await storage.db.get_user(user_id)
     
-    if not user_data or not user_data['captcha_passed']:
+    if not user_data or not user_data.captcha_passed:
         await user.send_captcha(message, bot)
         return
     
-    if not user.is_creator(user_id):
+    if not await user.is_creator(user_id):
         await user.send_access_denied(user_id, bot)
         return
     
@@ -584,7 +569,7 @@ async def handle_banadmin(message: types.Message, bot: Bot):
     replied_message_id = message.reply_to_message.message_id
     creator_id = message.from_user.id
     
-    result = database.get_original_message_info(replied_message_id, creator_id)
+    result = await storage.db.get_original_message_info(replied_message_id, creator_id)
     
     if not result:
         await message.answer("Не удалось найти автора сообщения!", 
@@ -598,7 +583,7 @@ async def handle_banadmin(message: types.Message, bot: Bot):
                              reply_markup=keyboards.create_system_keyboard())
         return
     
-    database.update_user(admin_id, {'is_admin': 0, 'is_coowner': 0})
+    await storage.db.update_user(admin_id, {'is_admin': 0, 'is_coowner': 0})
     
     await message.answer("Администратор удален", reply_markup=keyboards.create_system_keyboard())
     
@@ -610,13 +595,13 @@ async def handle_banadmin(message: types.Message, bot: Bot):
 
 async def handle_broadcast(message: types.Message, state: FSMContext, bot: Bot):
     user_id = message.from_user.id
-    user_data = database.get_user(user_id)
+    user_data = await storage.db.get_user(user_id)
     
-    if not user_data or not user_data['captcha_passed']:
+    if not user_data or not user_data.captcha_passed:
         await user.send_captcha(message, bot)
         return
     
-    if not user.is_creator(user_id):
+    if not await user.is_creator(user_id):
         await user.send_access_denied(user_id, bot)
         return
     
@@ -624,7 +609,9 @@ async def handle_broadcast(message: types.Message, state: FSMContext, bot: Bot):
     
     builder = InlineKeyboardBuilder()
     builder.button(text="Отправить всем", callback_data="confirm_bc")
+    builder.button(text="Отправить и закрепить", callback_data="confirm_bc_pin")
     builder.button(text="Отмена", callback_data="cancel_bc")
+    builder.adjust(2, 1)
     
     broadcast_text = ""
     if message.text:
@@ -688,74 +675,29 @@ async def confirm_broadcast_callback(query: types.CallbackQuery, state: FSMConte
             pass
         return
     
-    try:
-        if query.message.photo:
-            await query.message.edit_caption(caption="Начинаю рассылку...")
-        else:
-            await query.message.edit_text("Начинаю рассылку...")
-    except:
-        pass
-    
-    builder = InlineKeyboardBuilder()
-    builder.button(text="SYSTEM MESSAGE", url="https://t.me/FerumEA_terms/4")
-    
-    users = database.get_active_users()
-    
-    success = 0
-    failed = 0
-    
-    for user_id in users:
-        try:
-            if broadcast_message.photo:
-                msg = await bot.send_photo(
-                    user_id,
-                    broadcast_message.photo[-1].file_id,
-                    caption=broadcast_text,
-                    reply_markup=builder.as_markup()
-                )
-            elif broadcast_message.video:
-                msg = await bot.send_video(
-                    user_id,
-                    broadcast_message.video.file_id,
-                    caption=broadcast_text,
-                    reply_markup=builder.as_markup()
-                )
-            elif broadcast_message.document:
-                msg = await bot.send_document(
-                    user_id,
-                    broadcast_message.document.file_id,
-                    caption=broadcast_text,
-                    reply_markup=builder.as_markup()
-                )
-            elif broadcast_text:
-                msg = await bot.send_message(
-                    user_id,
-                    broadcast_text,
-                    reply_markup=builder.as_markup()
-                )
-            else:
-                msg = await broadcast_message.copy_to(user_id, reply_markup=builder.as_markup())
-            
-            await bot.pin_chat_message(user_id, msg.message_id, disable_notification=True)
-            success += 1
-        except Exception as e:
-            failed += 1
-        
-        await asyncio.sleep(0.05)
-    
-    try:
-        if query.message.photo:
-            await query.message.edit_caption(
-                caption=f"Рассылка завершена\nДоставлено: {success}\nНе доставлено: {failed}"
-            )
-        else:
-            await query.message.edit_text(
-                f"Рассылка завершена\nДоставлено: {success}\nНе доставлено: {failed}"
-            )
-    except:
-        pass
+    await broadcast.create(bot, query.from_user.id, broadcast_message, broadcast_text, query.data == "confirm_bc_pin", query.message)
     
-    await query.answer()
+    await query.answer("Рассылка запущена")
+
+async def handle_broadcast_control(query: types.CallbackQuery, bot: Bot):
+    if not await user.is_creator(query.from_user.id):
+        await query.answer("Доступ запрещен!")
+        return
+    
+    action, broadcast_id = query.data.split(":")
+    broadcast_id = int(broadcast_id)
+    
+    if action == "bc_pause":
+        done = broadcast.pause(broadcast_id)
+        await query.answer("Рассылка будет приостановлена" if done else "Рассылка не выполняется")
+    elif action == "bc_resume":
+        done = await broadcast.resume(bot, broadcast_id)
+        await query.answer("Рассылка продолжена" if done else "Рассылку нельзя продолжить")
+    elif action == "bc_stop":
+        done = await broadcast.cancel(bot, broadcast_id)
+        await query.answer("Рассылка отменена" if done else "Рассылка уже завершена")
+    else:
+        await query.answer()
 
 async def cancel_broadcast_callback(query: types.CallbackQuery, state: FSMContext):
     await state.clear()
@@ -770,45 +712,45 @@ async def cancel_broadcast_callback(query: types.CallbackQuery, state: FSMContex
 
 async def handle_botoff(message: types.Message, bot: Bot):
     user_id = message.from_user.id
-    user_data = database.get_user(user_id)
+    user_data = await storage.db.get_user(user_id)
     
-    if not user_data or not user_data['captcha_passed']:
+    if not user_data or not user_data.captcha_passed:
         await user.send_captcha(message, bot)
         return
     
-    if not user.is_creator(user_id):
+    if not await user.is_creator(user_id):
         await user.send_access_denied(user_id, bot)
         return
     
-    database.set_bot_setting('bot_enabled', '0')
+    await storage.db.set_bot_setting('bot_enabled', '0')
     
     await message.answer("Бот выключен", reply_markup=keyboards.create_system_keyboard())
 
 async def handle_boton(message: types.Message, bot: Bot):
     user_id = message.from_user.id
-    user_data = database.get_user(user_id)
+    user_data = await storage.db.get_user(user_id)
     
-    if not user_data or not user_data['captcha_passed']:
+    if not user_data or not user_data.captcha_passed:
         await user.send_captcha(message, bot)
         return
     
-    if not user.is_creator(user_id):
+    if not await user.is_creator(user_id):
         await user.send_access_denied(user_id, bot)
         return
     
-    database.set_bot_setting('bot_enabled', '1')
+    await storage.db.set_bot_setting('bot_enabled', '1')
     
     await message.answer("Бот включен", reply_markup=keyboards.create_system_keyboard())
 
 async def handle_mediaoff(message: types.Message, bot: Bot):
     user_id = message.from_user.id
-    user_data = database.get_user(user_id)
+    user_data = await storage.db.get_user(user_id)
     
-    if not user_data or not user_data['captcha_passed']:
+    if not user_data or not user_data.captcha_passed:
         await user.send_captcha(message, bot)
         return
     
-    if not user.is_admin(user_id):
+    if not await user.is_admin(user_id):
         await user.send_access_denied(user_id, bot)
         return
     
@@ -819,20 +761,20 @@ async def handle_mediaoff(message: types.Message, bot: Bot):
         return
     
     media_type = args[1].lower()
-    database.set_bot_setting(f'media_{media_type}_enabled', '0')
+    await storage.db.set_bot_setting(f'media_{media_type}_enabled', '0')
     
     await message.answer(f"Медиа-тип '{media_type}' отключен", 
                          reply_markup=keyboards.create_system_keyboard())
 
 async def handle_mediaon(message: types.Message, bot: Bot):
     user_id = message.from_user.id
-    user_data = database.get_user(user_id)
+    user_data = await storage.db.get_user(user_id)
     
-    if not user_data or not user_data['captcha_passed']:
+    if not user_data or not user_data.captcha_passed:
         await user.send_captcha(message, bot)
         return
     
-    if not user.is_admin(user_id):
+    if not await user.is_admin(user_id):
         await user.send_access_denied(user_id, bot)
         return
     
@@ -843,20 +785,20 @@ async def handle_mediaon(message: types.Message, bot: Bot):
         return
     
     media_type = args[1].lower()
-    database.set_bot_setting(f'media_{media_type}_enabled', '1')
+    await storage.db.set_bot_setting(f'media_{media_type}_enabled', '1')
     
     await message.answer(f"Медиа-тип '{media_type}' включен", 
                          reply_markup=keyboards.create_system_keyboard())
 
 async def handle_calldown(message: types.Message, rate_limiter, bot: Bot):
     user_id = message.from_user.id
-    user_data = database.get_user(user_id)
+    user_data = await storage.db.get_user(user_id)
     
-    if not user_data or not user_data['captcha_passed']:
+    if not user_data or not user_data.captcha_passed:
         await user.send_captcha(message, bot)
         return
     
-    if not user.is_admin(user_id):
+    if not await user.is_admin(user_id):
         await user.send_access_denied(user_id, bot)
         return
     
@@ -881,21 +823,21 @@ async def handle_calldown(message: types.Message, rate_limiter, bot: Bot):
 
 async def show_status(message: types.Message, rate_limiter, bot: Bot):
     user_id = message.from_user.id
-    user_data = database.get_user(user_id)
+    user_data = await storage.db.get_user(user_id)
     
-    if not user_data or not user_data['captcha_passed']:
+    if not user_data or not user_data.captcha_passed:
         await user.send_captcha(message, bot)
         return
     
-    if not user.is_admin(user_id):
+    if not await user.is_admin(user_id):
         await user.send_access_denied(user_id, bot)
         return
     
-    active_users = database.get_total_users()
-    total_messages = database.get_total_messages()
-    today_messages = database.get_daily_stats()
+    active_users = await storage.db.get_total_users()
+    total_messages = await storage.db.get_total_messages()
+    today_messages = await storage.db.get_daily_stats()
     
-    bot_enabled = database.get_bot_setting('bot_enabled', '1')
+    bot_enabled = await storage.db.get_bot_setting('bot_enabled', '1')
     bot_status = "Включен" if bot_enabled == '1' else "Выключен"
     
     status_text = f"📊 Статус бота:\n\n" \
@@ -903,48 +845,47 @@ async def show_status(message: types.Message, rate_limiter, bot: Bot):
                   f"Активных пользователей: {active_users}\n" \
                   f"Всего сообщений отправлено: {total_messages}\n" \
                   f"Сообщений сегодня: {today_messages}\n" \
-                  f"Задержка сообщений: {rate_limiter.cooldown} сек."
+                  f"Задержка сообщений: {rate_limiter.cooldown} сек.\n" \
+                  f"Скорость доставки: {delivery.scheduler.current_rate():.1f} сообщ/сек\n" \
+                  f"Очередь доставки: {sum(delivery.scheduler.backlog().values())}\n" \
+                  f"Параллельность доставки: {delivery.scheduler.concurrency_limit()}"
     
     await message.answer(status_text, reply_markup=keyboards.create_system_keyboard())
 
 async def handle_cleanup(message: types.Message, bot: Bot):
     user_id = message.from_user.id
-    user_data = database.get_user(user_id)
+    user_data = await storage.db.get_user(user_id)
     
-    if not user_data or not user_data['captcha_passed']:
+    if not user_data or not user_data.captcha_passed:
         await user.send_captcha(message, bot)
         return
     
-    if not user.is_creator(user_id):
+    if not await user.is_creator(user_id):
         await user.send_access_denied(user_id, bot)
         return
     
-    from datetime import datetime, timedelta
-    cutoff_date = datetime.now() - timedelta(days=30)
-    
-    database.cursor.execute('DELETE FROM messages WHERE created_at < ?', (cutoff_date,))
-    database.cursor.execute('DELETE FROM message_map WHERE created_at < ?', (cutoff_date,))
-    database.cursor.execute('DELETE FROM stats WHERE date < ?', (cutoff_date.strftime('%Y-%m-%d'),))
+    deleted = await storage.db.cleanup_old_data(30)
     
-    deleted_messages = database.cursor.rowcount
-    database.conn.commit()
-    
-    await message.answer(f"Очищено {deleted_messages} старых сообщений", 
+    await message.answer(f"Очищено {deleted['messages']} старых сообщений, {deleted['message_map']} связей сообщений, {deleted['stats']} записей статистики", 
                          reply_markup=keyboards.create_system_keyboard())
 
 async def handle_restart(message: types.Message, bot: Bot):
     user_id = message.from_user.id
-    user_data = database.get_user(user_id)
+    user_data = await storage.db.get_user(user_id)
     
-    if not user_data or not user_data['captcha_passed']:
+    if not user_data or not user_data.captcha_passed:
         await user.send_captcha(message, bot)
         return
     
-    if not user.is_creator(user_id):
+    if not await user.is_creator(user_id):
         await user.send_access_denied(user_id, bot)
         return
     
     await message.answer("Перезапуск бота...", reply_markup=keyboards.create_system_keyboard())
     
+    delivery.stop_processes()
+    # Writes buffered for the writer thread would be lost by execl
+    storage.db.shutdown()
+    
     python = sys.executable
     os.execl(python, python, *sys.argv)
\ No newline at end of file
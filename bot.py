@@ -11,7 +11,10 @@ from aiogram.enums import ParseMode, ChatMemberStatus
 import admin
 import user
 import keyboards
-import database
+import storage
+import delivery
+import broadcast
+import expiry
 
 logging.basicConfig(
     level=logging.INFO,
@@ -30,6 +33,7 @@ if not token:
     sys.exit(1)
 
 bot = Bot(token=token)
+bot.session.middleware(delivery.LaneMiddleware())
 dp = Dispatcher()
 
 rate_limiter = user.RateLimiter()
@@ -198,7 +202,7 @@ async def none_callback(query: types.CallbackQuery):
 async def admin_perm_callback(query: types.CallbackQuery, state: FSMContext):
     await admin.handle_admin_perm_callback(query, state, bot)
 
-@dp.callback_query(F.data == "confirm_bc", admin.BroadcastState.waiting_confirm)
+@dp.callback_query(F.data.in_({"confirm_bc", "confirm_bc_pin"}), admin.BroadcastState.waiting_confirm)
 async def confirm_bc_callback(query: types.CallbackQuery, state: FSMContext):
     await admin.confirm_broadcast_callback(query, state, bot)
 
@@ -206,6 +210,10 @@ async def confirm_bc_callback(query: types.CallbackQuery, state: FSMContext):
 async def cancel_bc_callback(query: types.CallbackQuery, state: FSMContext):
     await admin.cancel_broadcast_callback(query, state)
 
+@dp.callback_query(F.data.startswith("bc_"))
+async def broadcast_control_callback(query: types.CallbackQuery):
+    await admin.handle_broadcast_control(query, bot)
+
 @dp.callback_query(F.data.startswith("leave_yes:"))
 async def leave_yes_callback(query: types.CallbackQuery):
     await user.handle_leave_yes(query)
@@ -233,12 +241,7 @@ async def handle_paid_purchase(message: types.Message):
 @dp.my_chat_member()
 async def handle_chat_member(update: types.ChatMemberUpdated):
     if update.new_chat_member.status == ChatMemberStatus.KICKED:
-        database.delete_user_data(update.from_user.id)
-
-async def autodel_task():
-    while True:
-        await asyncio.sleep(60)
-        database.cleanup_old_messages()
+        await storage.db.delete_user_data(update.from_user.id)
 
 async def setup_webhook():
     try:
@@ -250,19 +253,26 @@ async def setup_webhook():
 async def main():
     logger.info("Starting bot...")
     await setup_webhook()
-    database.initialize_database()
-    autodel_task_obj = asyncio.create_task(autodel_task())
+    storage.configure()
+    storage.db.initialize()
+    delivery.scheduler.start(delivery.main_share())
+    delivery.start_processes()
+    resume_task_obj = asyncio.create_task(user.resume_pending_deliveries(bot))
+    await broadcast.resume_broadcasts(bot)
+    expiry.scheduler.start(bot)
     
     try:
         await dp.start_polling(bot)
     except Exception as e:
         logger.error(e)
     finally:
-        autodel_task_obj.cancel()
-        try:
-            await autodel_task_obj
-        except asyncio.CancelledError:
-            pass
+        resume_task_obj.cancel()
+        await asyncio.gather(resume_task_obj, return_exceptions=True)
+        await expiry.scheduler.stop()
+        await broadcast.stop_all()
+        await delivery.scheduler.stop()
+        storage.db.shutdown()
+        delivery.stop_processes()
         await bot.session.close()
         logger.info("Bot stopped")
 
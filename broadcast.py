@@ -0,0 +1,256 @@
+# broadcast.py
+import asyncio
+import logging
+import time
+from typing import Dict, Optional, Set
+from aiogram import Bot, types
+from aiogram.utils.keyboard import InlineKeyboardBuilder
+import storage
+import delivery
+
+logger = logging.getLogger(__name__)
+
+# Progress is checkpointed after every chunk, so a restart repeats at most one chunk
+CHUNK_SIZE = 200
+# Status edits go through the interactive lane, so keep them rare
+PROGRESS_INTERVAL = 5
+
+ERROR_NAMES = {
+    'blocked': 'бот заблокирован',
+    'deactivated': 'аккаунт удален',
+    'chat_not_found': 'чат не найден',
+    'flood_wait': 'флуд-лимит',
+    'bad_request': 'ошибка запроса',
+    'network': 'сеть',
+    'other': 'прочее'
+}
+
+running: Dict[int, asyncio.Task] = {}
+pause_requested: Set[int] = set()
+cancel_requested: Set[int] = set()
+
+def create_broadcast_keyboard():
+    builder = InlineKeyboardBuilder()
+    builder.button(text="SYSTEM MESSAGE", url="https://t.me/FerumEA_terms/4")
+    return builder.as_markup()
+
+def create_control_keyboard(broadcast_id: int, paused: bool = False):
+    builder = InlineKeyboardBuilder()
+    if paused:
+        builder.button(text="▶️ Продолжить", callback_data=f"bc_resume:{broadcast_id}")
+    else:
+        builder.button(text="⏸ Пауза", callback_data=f"bc_pause:{broadcast_id}")
+    builder.button(text="✖️ Отменить", callback_data=f"bc_stop:{broadcast_id}")
+    builder.adjust(2)
+    return builder.as_markup()
+
+async def edit_status(bot: Bot, broadcast: dict, text: str, reply_markup=None):
+    try:
+        if broadcast['status_is_caption']:
+            await bot.edit_message_caption(
+                chat_id=broadcast['status_chat_id'],
+                message_id=broadcast['status_message_id'],
+                caption=text,
+                reply_markup=reply_markup
+            )
+        else:
+            await bot.edit_message_text(
+                chat_id=broadcast['status_chat_id'],
+                message_id=broadcast['status_message_id'],
+                text=text,
+                reply_markup=reply_markup
+            )
+    except Exception as e:
+        logger.debug(f"Broadcast {broadcast['broadcast_id']}: status update failed: {e}")
+
+async def send_copy(bot: Bot, chat_id: int, message: types.Message, text: str, reply_markup):
+    if message.photo:
+        return await bot.send_photo(chat_id, message.photo[-1].file_id, caption=text, reply_markup=reply_markup)
+    elif message.video:
+        return await bot.send_video(chat_id, message.video.file_id, caption=text, reply_markup=reply_markup)
+    elif message.document:
+        return await bot.send_document(chat_id, message.document.file_id, caption=text, reply_markup=reply_markup)
+    elif text:
+        return await bot.send_message(chat_id, text, reply_markup=reply_markup)
+    else:
+        return await message.copy_to(chat_id, reply_markup=reply_markup)
+
+async def create(bot: Bot, creator_id: int, message: types.Message, text: str, pin: bool, status_message: types.Message) -> int:
+    broadcast_id = await storage.db.create_broadcast(
+        creator_id,
+        message.model_dump_json(exclude_none=True),
+        text,
+        1 if pin else 0,
+        status_message.chat.id,
+        status_message.message_id,
+        0 if status_message.text is not None else 1
+    )
+    start(bot, broadcast_id)
+    return broadcast_id
+
+def start(bot: Bot, broadcast_id: int):
+    if broadcast_id in running:
+        return
+    task = asyncio.create_task(run(bot, broadcast_id))
+    running[broadcast_id] = task
+    task.add_done_callback(lambda _: running.pop(broadcast_id, None))
+
+class BroadcastProgress:
+    def __init__(self, sent: int, failed: int, total: int):
+        self.sent = sent
+        self.failed = failed
+        self.total = total
+        self.done = 0
+        self.errors: Dict[str, int] = {}
+        self.started = time.monotonic()
+        self.fanout: Optional[delivery.Fanout] = None
+
+    def add(self, fanout: delivery.Fanout):
+        self.sent += fanout.sent
+        self.failed += fanout.failed
+        self.done += fanout.total
+        for error, count in fanout.errors.items():
+            self.errors[error] = self.errors.get(error, 0) + count
+        self.fanout = None
+
+    def format(self, title: str, finished: bool = False) -> str:
+        sent, failed, done = self.sent, self.failed, self.done
+        errors = dict(self.errors)
+        if self.fanout:
+            sent += self.fanout.sent
+            failed += self.fanout.failed
+            done += self.fanout.sent + self.fanout.failed
+            for error, count in self.fanout.errors.items():
+                errors[error] = errors.get(error, 0) + count
+
+        elapsed = time.monotonic() - self.started
+        rate = done / elapsed if elapsed > 0 else 0.0
+        remaining = self.total - done
+
+        lines = [title, f"Доставлено: {sent}", f"Не доставлено: {failed}"]
+        if not finished:
+            lines.append(f"Осталось: {remaining}")
+        if rate > 0:
+            lines.append(f"Скорость: {rate:.1f} сообщ/сек")
+        if errors:
+            lines.append("Ошибки: " + ", ".join(f"{ERROR_NAMES.get(error, error)} — {count}" for error, count in sorted(errors.items(), key=lambda item: -item[1])))
+        if finished:
+            lines.append(f"Время: {format_duration(elapsed)}")
+        elif rate > 0 and remaining > 0:
+            lines.append(f"Осталось времени: ~{format_duration(remaining / rate)}")
+        return "\n".join(lines)
+
+def format_duration(seconds: float) -> str:
+    seconds = int(seconds)
+    hours, seconds = divmod(seconds, 3600)
+    minutes, seconds = divmod(seconds, 60)
+    if hours:
+        return f"{hours} ч {minutes} мин"
+    if minutes:
+        return f"{minutes} мин {seconds} сек"
+    return f"{seconds} сек"
+
+async def report_progress(bot: Bot, broadcast: dict, progress: BroadcastProgress):
+    last_text = None
+    while True:
+        await asyncio.sleep(PROGRESS_INTERVAL)
+        text = progress.format("Рассылка идет")
+        if text != last_text:
+            await edit_status(bot, broadcast, text, create_control_keyboard(broadcast['broadcast_id']))
+            last_text = text
+
+async def run(bot: Bot, broadcast_id: int):
+    broadcast = await storage.db.get_broadcast(broadcast_id)
+    if not broadcast:
+        return
+
+    try:
+        message = types.Message.model_validate_json(broadcast['payload'], context={"bot": bot})
+    except Exception as e:
+        logger.error(f"Broadcast {broadcast_id}: cannot restore message: {e}")
+        await storage.db.update_broadcast(broadcast_id, {'status': 'failed'})
+        return
+
+    reply_markup = create_broadcast_keyboard()
+
+    async def send(user_id):
+        msg = await send_copy(bot, user_id, message, broadcast['text'], reply_markup)
+        if broadcast['pin']:
+            try:
+                await bot.pin_chat_message(user_id, msg.message_id, disable_notification=True)
+            except Exception as e:
+                pass
+        return True
+
+    users = sorted(user_id for user_id in await storage.db.get_active_users() if user_id > broadcast['last_user_id'])
+    progress = BroadcastProgress(broadcast['sent'], broadcast['failed'], len(users))
+    await edit_status(bot, broadcast, progress.format("Рассылка запущена"), create_control_keyboard(broadcast_id))
+    reporter = asyncio.create_task(report_progress(bot, broadcast, progress))
+
+    try:
+        for start_index in range(0, len(users), CHUNK_SIZE):
+            if broadcast_id in pause_requested:
+                pause_requested.discard(broadcast_id)
+                await storage.db.update_broadcast(broadcast_id, {'status': 'paused'})
+                reporter.cancel()
+                await edit_status(bot, broadcast, progress.format("Рассылка приостановлена"),
+                                  create_control_keyboard(broadcast_id, paused=True))
+                return
+
+            chunk = users[start_index:start_index + CHUNK_SIZE]
+            progress.fanout = delivery.Fanout(f"Broadcast {broadcast_id}", len(chunk))
+            fanout = await delivery.scheduler.fanout(chunk, send, f"Broadcast {broadcast_id}", lane_name='broadcast', fanout=progress.fanout)
+            progress.add(fanout)
+            await storage.db.update_broadcast(broadcast_id, {'last_user_id': chunk[-1], 'sent': progress.sent, 'failed': progress.failed})
+    except asyncio.CancelledError:
+        if broadcast_id in cancel_requested:
+            cancel_requested.discard(broadcast_id)
+            await storage.db.update_broadcast(broadcast_id, {'status': 'cancelled'})
+            await edit_status(bot, broadcast, progress.format("Рассылка отменена", finished=True))
+        raise
+    finally:
+        reporter.cancel()
+
+    await storage.db.update_broadcast(broadcast_id, {'status': 'done'})
+    await edit_status(bot, broadcast, progress.format("Рассылка завершена", finished=True))
+
+def pause(broadcast_id: int) -> bool:
+    if broadcast_id not in running:
+        return False
+    pause_requested.add(broadcast_id)
+    return True
+
+async def resume(bot: Bot, broadcast_id: int) -> bool:
+    broadcast = await storage.db.get_broadcast(broadcast_id)
+    if not broadcast or broadcast['status'] not in ('paused', 'running'):
+        return False
+    pause_requested.discard(broadcast_id)
+    await storage.db.update_broadcast(broadcast_id, {'status': 'running'})
+    start(bot, broadcast_id)
+    return True
+
+async def cancel(bot: Bot, broadcast_id: int) -> bool:
+    broadcast = await storage.db.get_broadcast(broadcast_id)
+    if not broadcast or broadcast['status'] not in ('paused', 'running'):
+        return False
+
+    task = running.get(broadcast_id)
+    if task:
+        cancel_requested.add(broadcast_id)
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+    else:
+        await storage.db.update_broadcast(broadcast_id, {'status': 'cancelled'})
+        await edit_status(bot, broadcast, f"Рассылка отменена\nДоставлено: {broadcast['sent']}\nНе доставлено: {broadcast['failed']}")
+    return True
+
+async def resume_broadcasts(bot: Bot):
+    for broadcast_id in await storage.db.get_running_broadcasts():
+        logger.info(f"Resuming broadcast {broadcast_id}")
+        start(bot, broadcast_id)
+
+async def stop_all():
+    tasks = list(running.values())
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
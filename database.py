@@ -1,14 +1,66 @@
 # database.py
+import asyncio
+import functools
 import sqlite3
 import base64
-from datetime import datetime, timedelta
-from typing import Optional, Dict, Any, List, Tuple
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from typing import Optional, Dict, Any, List, Tuple, Set
 import logging
 import os
 import re
 
 logger = logging.getLogger(__name__)
 
+# Bulk deletes run in short transactions so the writer lock is released between chunks
+CLEANUP_CHUNK = 500
+
+# Reverse ignore index: sender -> users ignoring them. Only the main process loads it,
+# worker processes fall back to the indexed query
+ignored_by: Optional[Dict[int, Set[int]]] = None
+# Fan-out recipients (not banned, captcha passed, reachable), loaded the same way
+active_users: Optional[Set[int]] = None
+ACTIVE_FIELDS = ('banned', 'captcha_passed', 'reachable')
+
+# bot_settings snapshot (main process only); set_bot_setting swaps in a new dict,
+# so readers never see a half-applied change
+bot_settings: Optional[Dict[str, str]] = None
+
+# Recently read user rows (main process only). Writes from this process update or drop
+# the cached row; the TTL bounds staleness from writes made by delivery worker processes
+USER_CACHE_SIZE = 10000
+USER_CACHE_TTL = 300
+user_cache: Optional[OrderedDict] = None
+user_cache_lock = threading.Lock()
+# Bumped on every users write, so a read that raced a write is not cached
+user_cache_generation = 0
+
+USER_COLUMNS = ('user_id', 'language_code', 'encrypted_name', 'encrypted_username', 'tag_enabled', 'tag_text', 'custom_tag',
+                'custom_tag_enabled', 'admin_tag_enabled', 'creator_tag_enabled', 'is_admin', 'is_creator', 'is_coowner',
+                'protect_content', 'autodel_time', 'banned', 'muted_until', 'warnings', 'last_message_text', 'last_message_time',
+                'created_at', 'last_active', 'message_count', 'captcha_passed', 'reachable')
+USER_FLAGS = frozenset(('tag_enabled', 'custom_tag_enabled', 'admin_tag_enabled', 'creator_tag_enabled', 'is_admin', 'is_creator',
+                        'is_coowner', 'protect_content', 'banned', 'captcha_passed', 'reachable'))
+# Column subsets for hot callers; columns outside the projection are left unset on the record
+USER_PERMISSIONS = ('user_id', 'is_admin', 'is_creator', 'is_coowner')
+USER_SENDER = ('user_id', 'encrypted_name', 'encrypted_username', 'tag_enabled', 'tag_text', 'custom_tag', 'custom_tag_enabled',
+               'admin_tag_enabled', 'creator_tag_enabled', 'is_admin', 'is_creator', 'is_coowner', 'protect_content', 'autodel_time')
+# handle_message passes its gate record on to fan-out, so it carries the sender columns too
+USER_GATE = USER_SENDER + ('captcha_passed', 'banned', 'muted_until', 'last_message_text')
+
+# Delivered copies are buffered and written in one transaction; anything reading
+# messages or message_map flushes the buffer first
+WRITE_BEHIND_DELAY = 0.05
+pending_messages: List[tuple] = []
+pending_message_maps: List[tuple] = []
+pending_lock = threading.Lock()
+flush_handle: Optional[asyncio.TimerHandle] = None
+# Set while a flush has taken rows from the buffer but not committed them yet
+flush_running = False
+
 def adapt_datetime(dt):
     return dt.isoformat()
 
@@ -18,10 +70,79 @@ def convert_datetime(b):
 sqlite3.register_adapter(datetime, adapt_datetime)
 sqlite3.register_converter("datetime", convert_datetime)
 
-conn = sqlite3.connect('data/anonchat.db', detect_types=sqlite3.PARSE_DECLTYPES, check_same_thread=False)
-cursor = conn.cursor()
+DATABASE_PATH = 'data/anonchat.db'
+
+# SQLite tuning profiles, selected with DATABASE_PROFILE; DATABASE_SYNCHRONOUS,
+# DATABASE_CACHE_SIZE and DATABASE_MMAP_SIZE override single values
+PROFILES = {
+    'safe': {'synchronous': 'FULL', 'cache_size': -8000, 'mmap_size': 0},
+    'balanced': {'synchronous': 'NORMAL', 'cache_size': -32000, 'mmap_size': 134217728},
+    'fast': {'synchronous': 'OFF', 'cache_size': -131072, 'mmap_size': 1073741824}
+}
+SYNCHRONOUS_MODES = ('OFF', 'NORMAL', 'FULL', 'EXTRA')
+
+# All writes go through one writer thread on the main connection; reader threads
+# each open their own read-only connection. conn/cursor resolve to the calling thread's one
+writer_conn = sqlite3.connect(DATABASE_PATH, detect_types=sqlite3.PARSE_DECLTYPES, check_same_thread=False)
+local = threading.local()
+
+class ThreadConnection:
+    def __init__(self, name: str, default):
+        self.name = name
+        self.default = default
+
+    def __getattr__(self, attribute):
+        return getattr(getattr(local, self.name, self.default), attribute)
+
+conn = ThreadConnection('conn', writer_conn)
+cursor = ThreadConnection('cursor', writer_conn.cursor())
+
+writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix='db-writer')
+readers: Optional[ThreadPoolExecutor] = None
+
+def load_tuning() -> Dict[str, Any]:
+    profile_name = os.getenv('DATABASE_PROFILE', 'balanced')
+    if profile_name not in PROFILES:
+        logger.warning(f"Unknown DATABASE_PROFILE {profile_name}, using balanced")
+        profile_name = 'balanced'
+    settings = dict(PROFILES[profile_name])
+    
+    if os.getenv('DATABASE_SYNCHRONOUS'):
+        settings['synchronous'] = os.getenv('DATABASE_SYNCHRONOUS').upper()
+    if settings['synchronous'] not in SYNCHRONOUS_MODES:
+        logger.warning(f"Unknown DATABASE_SYNCHRONOUS {settings['synchronous']}, using NORMAL")
+        settings['synchronous'] = 'NORMAL'
+    if os.getenv('DATABASE_CACHE_SIZE'):
+        settings['cache_size'] = int(os.getenv('DATABASE_CACHE_SIZE'))
+    if os.getenv('DATABASE_MMAP_SIZE'):
+        settings['mmap_size'] = int(os.getenv('DATABASE_MMAP_SIZE'))
+    return settings
+
+def apply_tuning(connection, settings: Dict[str, Any]):
+    connection.execute(f"PRAGMA cache_size = {int(settings['cache_size'])}")
+    connection.execute(f"PRAGMA mmap_size = {int(settings['mmap_size'])}")
+
+def open_reader(settings: Dict[str, Any]):
+    local.conn = sqlite3.connect(f'file:{DATABASE_PATH}?mode=ro', uri=True, detect_types=sqlite3.PARSE_DECLTYPES, check_same_thread=False)
+    local.conn.execute('PRAGMA query_only = 1')
+    apply_tuning(local.conn, settings)
+    local.cursor = local.conn.cursor()
+
+def configure():
+    # WAL lets the reader connections run alongside the writer instead of queueing behind it
+    global readers
+    if readers:
+        return
+    settings = load_tuning()
+    writer_conn.execute('PRAGMA journal_mode = WAL')
+    writer_conn.execute(f"PRAGMA synchronous = {settings['synchronous']}")
+    apply_tuning(writer_conn, settings)
+    readers = ThreadPoolExecutor(max_workers=int(os.getenv('DATABASE_READERS', '4')), thread_name_prefix='db-reader',
+                                 initializer=open_reader, initargs=(settings,))
+    logger.info(f"Database: WAL, synchronous={settings['synchronous']}, cache_size={settings['cache_size']}, mmap_size={settings['mmap_size']}")
 
 def initialize_database():
+    configure()
     cursor.execute('''
     CREATE TABLE IF NOT EXISTS users (
         user_id INTEGER PRIMARY KEY,
@@ -47,10 +168,16 @@ def initialize_database():
         created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
         last_active DATETIME DEFAULT CURRENT_TIMESTAMP,
         message_count INTEGER DEFAULT 0,
-        captcha_passed INTEGER DEFAULT 0
+        captcha_passed INTEGER DEFAULT 0,
+        reachable INTEGER DEFAULT 1
     )
     ''')
 
+    cursor.execute('PRAGMA table_info(users)')
+    user_columns = [row[1] for row in cursor.fetchall()]
+    if 'reachable' not in user_columns:
+        cursor.execute('ALTER TABLE users ADD COLUMN reachable INTEGER DEFAULT 1')
+
     cursor.execute('''
     CREATE TABLE IF NOT EXISTS messages (
         message_id INTEGER,
@@ -74,10 +201,22 @@ def initialize_database():
         is_edited INTEGER DEFAULT 0,
         edited_at DATETIME,
         created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+        expires_at DATETIME,
         PRIMARY KEY (message_id, user_id)
     )
     ''')
 
+    cursor.execute('PRAGMA table_info(messages)')
+    message_columns = [row[1] for row in cursor.fetchall()]
+    if 'expires_at' not in message_columns:
+        cursor.execute('ALTER TABLE messages ADD COLUMN expires_at DATETIME')
+        cursor.execute('''
+            UPDATE messages SET expires_at = (
+                SELECT strftime('%Y-%m-%dT%H:%M:%S', messages.created_at, '+' || users.autodel_time || ' minutes', 'localtime')
+                FROM users WHERE users.user_id = messages.original_sender_id AND users.autodel_time > 0
+            )
+        ''')
+
     cursor.execute('''
     CREATE TABLE IF NOT EXISTS message_map (
         user_message_id INTEGER,
@@ -140,10 +279,68 @@ def initialize_database():
     )
     ''')
 
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS outbox (
+        job_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        original_message_id INTEGER,
+        sender_id INTEGER,
+        payload TEXT,
+        total INTEGER DEFAULT 0,
+        sent INTEGER DEFAULT 0,
+        failed INTEGER DEFAULT 0,
+        status TEXT DEFAULT 'pending',
+        created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+        updated_at DATETIME,
+        poll_message_id INTEGER
+    )
+    ''')
+
+    cursor.execute('PRAGMA table_info(outbox)')
+    outbox_columns = [row[1] for row in cursor.fetchall()]
+    if 'poll_message_id' not in outbox_columns:
+        cursor.execute('ALTER TABLE outbox ADD COLUMN poll_message_id INTEGER')
+
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS outbox_shards (
+        job_id INTEGER,
+        shard INTEGER,
+        sent INTEGER DEFAULT 0,
+        failed INTEGER DEFAULT 0,
+        status TEXT DEFAULT 'pending',
+        updated_at DATETIME,
+        PRIMARY KEY (job_id, shard)
+    )
+    ''')
+
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS broadcasts (
+        broadcast_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        creator_id INTEGER,
+        payload TEXT,
+        text TEXT,
+        pin INTEGER DEFAULT 0,
+        status TEXT DEFAULT 'running',
+        last_user_id INTEGER DEFAULT 0,
+        sent INTEGER DEFAULT 0,
+        failed INTEGER DEFAULT 0,
+        status_chat_id INTEGER,
+        status_message_id INTEGER,
+        status_is_caption INTEGER DEFAULT 0,
+        created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+        updated_at DATETIME
+    )
+    ''')
+
     cursor.execute('CREATE INDEX IF NOT EXISTS idx_messages_user ON messages(user_id)')
     cursor.execute('CREATE INDEX IF NOT EXISTS idx_messages_original ON messages(original_message_id)')
     cursor.execute('CREATE INDEX IF NOT EXISTS idx_message_map ON message_map(user_message_id)')
     cursor.execute('CREATE INDEX IF NOT EXISTS idx_ignored_users ON ignored_users(user_id)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_ignored_by ON ignored_users(ignored_user_id)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_outbox_status ON outbox(status)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_messages_expires ON messages(expires_at)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_messages_sender_created ON messages(original_sender_id, created_at)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_messages_created ON messages(created_at)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_message_map_created ON message_map(created_at)')
 
     CREATOR_ID = int(os.getenv('CREATOR_ID', '8326355672'))
     cursor.execute('SELECT user_id FROM users WHERE user_id = ?', (CREATOR_ID,))
@@ -161,6 +358,19 @@ def initialize_database():
                       ('bot_start_time', datetime.now().isoformat()))
 
     conn.commit()
+    load_ignore_index()
+    load_active_users()
+    load_bot_settings()
+    global user_cache
+    user_cache = OrderedDict()
+
+def load_ignore_index():
+    global ignored_by
+    index: Dict[int, Set[int]] = {}
+    cursor.execute('SELECT user_id, ignored_user_id FROM ignored_users')
+    for user_id, ignored_user_id in cursor.fetchall():
+        index.setdefault(ignored_user_id, set()).add(user_id)
+    ignored_by = index
 
 def encrypt_text(text):
     if not text:
@@ -172,44 +382,120 @@ def decrypt_text(encrypted):
         return ''
     return base64.b64decode(encrypted.encode()).decode()
 
-def get_user(user_id):
-    cursor.execute('SELECT * FROM users WHERE user_id = ?', (user_id,))
+class UserRecord:
+    # Records are shared through the cache, so they are never modified after creation
+    __slots__ = USER_COLUMNS
+
+    def __init__(self, columns, values):
+        for column, value in zip(columns, values):
+            setattr(self, column, bool(value) if column in USER_FLAGS else value)
+
+    def copy(self):
+        record = UserRecord((), ())
+        for column in USER_COLUMNS:
+            if hasattr(self, column):
+                setattr(record, column, getattr(self, column))
+        return record
+
+def cached_user(user_id, columns=USER_COLUMNS) -> Optional[UserRecord]:
+    if user_cache is None:
+        return None
+    with user_cache_lock:
+        entry = user_cache.get(user_id)
+        if not entry:
+            return None
+        stamp, user, loaded = entry
+        if time.monotonic() - stamp > USER_CACHE_TTL:
+            del user_cache[user_id]
+            return None
+        if not loaded.issuperset(columns):
+            return None
+        user_cache.move_to_end(user_id)
+        return user
+
+def cache_user(user_id, user, columns, generation):
+    if user_cache is None:
+        return
+    with user_cache_lock:
+        if generation != user_cache_generation:
+            return
+        stamp = time.monotonic()
+        loaded = frozenset(columns)
+        entry = user_cache.get(user_id)
+        if entry and stamp - entry[0] <= USER_CACHE_TTL and not loaded.issuperset(entry[2]):
+            # Keep columns loaded earlier by other projections
+            merged = entry[1].copy()
+            for column in columns:
+                setattr(merged, column, getattr(user, column))
+            user, stamp, loaded = merged, entry[0], loaded | entry[2]
+        user_cache[user_id] = (stamp, user, loaded)
+        user_cache.move_to_end(user_id)
+        if len(user_cache) > USER_CACHE_SIZE:
+            user_cache.popitem(last=False)
+
+def update_cached_user(user_id, updates: Dict[str, Any], count_message: bool = False):
+    global user_cache_generation
+    with user_cache_lock:
+        user_cache_generation += 1
+        entry = user_cache.get(user_id) if user_cache is not None else None
+        if not entry:
+            return
+        stamp, user, loaded = entry
+        user = user.copy()
+        for key, value in updates.items():
+            setattr(user, key, bool(value) if key in USER_FLAGS else value)
+        loaded = loaded.union(updates)
+        if count_message and 'message_count' in loaded:
+            user.message_count += 1
+        user_cache[user_id] = (stamp, user, loaded)
+
+def invalidate_users(user_ids):
+    global user_cache_generation
+    with user_cache_lock:
+        user_cache_generation += 1
+        if user_cache is not None:
+            for user_id in user_ids:
+                user_cache.pop(user_id, None)
+
+def get_user(user_id, columns=USER_COLUMNS) -> Optional[UserRecord]:
+    user = cached_user(user_id, columns)
+    if user:
+        return user
+    
+    generation = user_cache_generation
+    cursor.execute(f'SELECT {", ".join(columns)} FROM users WHERE user_id = ?', (user_id,))
     row = cursor.fetchone()
     if row:
-        return {
-            'user_id': row[0],
-            'language_code': row[1],
-            'encrypted_name': row[2],
-            'encrypted_username': row[3],
-            'tag_enabled': bool(row[4]),
-            'tag_text': row[5],
-            'custom_tag': row[6],
-            'custom_tag_enabled': bool(row[7]),
-            'admin_tag_enabled': bool(row[8]),
-            'creator_tag_enabled': bool(row[9]),
-            'is_admin': bool(row[10]),
-            'is_creator': bool(row[11]),
-            'is_coowner': bool(row[12]),
-            'protect_content': bool(row[13]),
-            'autodel_time': row[14],
-            'banned': bool(row[15]),
-            'muted_until': row[16],
-            'warnings': row[17],
-            'last_message_text': row[18],
-            'last_message_time': row[19],
-            'created_at': row[20],
-            'last_active': row[21],
-            'message_count': row[22],
-            'captcha_passed': bool(row[23])
-        }
+        user = UserRecord(columns, row)
+        cache_user(user_id, user, columns, generation)
+        return user
     return None
 
+def create_user(user_id, language_code):
+    cursor.execute('''
+        INSERT INTO users (user_id, language_code, created_at, last_active, captcha_passed)
+        VALUES (?, ?, ?, ?, 0)
+    ''', (user_id, language_code, datetime.now(), datetime.now()))
+    conn.commit()
+    invalidate_users([user_id])
+
+def grant_role(user_id, role):
+    if get_user(user_id, ('user_id',)):
+        update_user(user_id, {role: 1})
+    else:
+        cursor.execute(f'INSERT INTO users (user_id, {role}) VALUES (?, 1)', (user_id,))
+        conn.commit()
+        invalidate_users([user_id])
+
 def update_user(user_id, updates: Dict[str, Any]):
     set_clause = ', '.join([f'{key} = ?' for key in updates.keys()])
     values = list(updates.values())
     values.append(user_id)
     cursor.execute(f'UPDATE users SET {set_clause} WHERE user_id = ?', values)
     conn.commit()
+    update_cached_user(user_id, updates)
+    if any(key in ACTIVE_FIELDS for key in updates):
+        refresh_active_user(user_id)
 
 def update_stats(user_id):
     today = datetime.now().strftime('%Y-%m-%d')
@@ -225,26 +511,55 @@ def update_stats(user_id):
         ON CONFLICT(user_id, date) DO UPDATE SET 
         message_count = message_count + 1
     ''', (user_id, today))
+    last_active = datetime.now()
     cursor.execute('UPDATE users SET last_active = ?, message_count = message_count + 1 WHERE user_id = ?', 
-                  (datetime.now(), user_id))
+                  (last_active, user_id))
     conn.commit()
+    update_cached_user(user_id, {'last_active': last_active}, count_message=True)
+
+def load_active_users():
+    global active_users
+    cursor.execute('SELECT user_id FROM users WHERE banned = 0 AND captcha_passed = 1 AND reachable = 1')
+    active_users = {row[0] for row in cursor.fetchall()}
+
+def refresh_active_user(user_id):
+    if active_users is None:
+        return
+    cursor.execute('SELECT banned, captcha_passed, reachable FROM users WHERE user_id = ?', (user_id,))
+    row = cursor.fetchone()
+    if row and not row[0] and row[1] and row[2]:
+        active_users.add(user_id)
+    else:
+        active_users.discard(user_id)
 
 def get_active_users():
-    cursor.execute('SELECT user_id FROM users WHERE banned = 0 AND captcha_passed = 1')
+    if active_users is not None:
+        return list(active_users)
+    cursor.execute('SELECT user_id FROM users WHERE banned = 0 AND captcha_passed = 1 AND reachable = 1')
     return [row[0] for row in cursor.fetchall()]
 
+def mark_unreachable(user_ids):
+    cursor.executemany('UPDATE users SET reachable = 0 WHERE user_id = ?', [(user_id,) for user_id in user_ids])
+    conn.commit()
+    invalidate_users(user_ids)
+    if active_users is not None:
+        active_users.difference_update(user_ids)
+
 def get_admin_users():
     cursor.execute('SELECT user_id FROM users WHERE (is_admin = 1 OR is_creator = 1 OR is_coowner = 1) AND banned = 0 AND captcha_passed = 1')
     return [row[0] for row in cursor.fetchall()]
 
-def save_message(message_data: Dict[str, Any]):
-    cursor.execute('''
-        INSERT INTO messages 
-        (message_id, user_id, original_message_id, original_sender_id, message_type, content, 
-         tag_enabled, tag_text, custom_tag, custom_tag_enabled, admin_tag, creator_tag, coowner_tag,
-         protect_content, paid_media, paid_stars, is_reply, reply_to_message_id, is_edited, edited_at)
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-    ''', (
+MESSAGE_INSERT = '''
+    INSERT OR REPLACE INTO messages 
+    (message_id, user_id, original_message_id, original_sender_id, message_type, content, 
+     tag_enabled, tag_text, custom_tag, custom_tag_enabled, admin_tag, creator_tag, coowner_tag,
+     protect_content, paid_media, paid_stars, is_reply, reply_to_message_id, is_edited, edited_at, expires_at)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+'''
+MESSAGE_MAP_INSERT = 'INSERT OR REPLACE INTO message_map (user_message_id, target_user_id, target_message_id) VALUES (?, ?, ?)'
+
+def message_row(message_data: Dict[str, Any]):
+    return (
         message_data['message_id'],
         message_data['user_id'],
         message_data['original_message_id'],
@@ -264,13 +579,53 @@ def save_message(message_data: Dict[str, Any]):
         message_data['is_reply'],
         message_data['reply_to_message_id'],
         message_data.get('is_edited', 0),
-        message_data.get('edited_at')
-    ))
-    conn.commit()
+        message_data.get('edited_at'),
+        message_data.get('expires_at')
+    )
+
+def save_delivery(message_data: Dict[str, Any]):
+    with pending_lock:
+        pending_messages.append(message_row(message_data))
+        pending_message_maps.append((message_data['original_message_id'], message_data['user_id'], message_data['message_id']))
+    
+    global flush_handle
+    if flush_handle is None:
+        try:
+            flush_handle = asyncio.get_running_loop().call_later(WRITE_BEHIND_DELAY, submit_flush)
+        except RuntimeError:
+            flush_deliveries()
+
+def submit_flush():
+    global flush_handle
+    flush_handle = None
+    writer.submit(flush_deliveries)
+
+def flush_deliveries():
+    global pending_messages, pending_message_maps, flush_running
+    with pending_lock:
+        if not pending_messages:
+            return
+        messages, pending_messages = pending_messages, []
+        message_maps, pending_message_maps = pending_message_maps, []
+        flush_running = True
+    
+    try:
+        cursor.executemany(MESSAGE_INSERT, messages)
+        cursor.executemany(MESSAGE_MAP_INSERT, message_maps)
+        conn.commit()
+    except Exception as e:
+        conn.rollback()
+        logger.error(f"Delivery flush failed, {len(messages)} rows kept for retry: {e}")
+        # Put the rows back ahead of anything buffered meanwhile, so the next flush retries them
+        with pending_lock:
+            pending_messages = messages + pending_messages
+            pending_message_maps = message_maps + pending_message_maps
+        raise
+    finally:
+        flush_running = False
 
 def save_message_map(user_message_id, target_user_id, target_message_id):
-    cursor.execute('INSERT OR REPLACE INTO message_map (user_message_id, target_user_id, target_message_id) VALUES (?, ?, ?)', 
-                  (user_message_id, target_user_id, target_message_id))
+    cursor.execute(MESSAGE_MAP_INSERT, (user_message_id, target_user_id, target_message_id))
     conn.commit()
 
 def get_message_map(original_message_id, target_user_id):
@@ -279,6 +634,124 @@ def get_message_map(original_message_id, target_user_id):
     result = cursor.fetchone()
     return result[0] if result else None
 
+def get_message_map_targets(original_message_id):
+    cursor.execute('SELECT target_user_id, target_message_id FROM message_map WHERE user_message_id = ?', (original_message_id,))
+    return dict(cursor.fetchall())
+
+def get_delivered_user_ids(original_sender_id, original_message_id):
+    # message_map is keyed by the sender's chat message_id alone, which repeats across senders
+    cursor.execute('SELECT user_id FROM messages WHERE original_sender_id = ? AND original_message_id = ?', 
+                  (original_sender_id, original_message_id))
+    return {row[0] for row in cursor.fetchall()}
+
+def create_outbox_job(original_message_id, sender_id, payload, total, poll_message_id=None):
+    cursor.execute('''
+        INSERT INTO outbox (original_message_id, sender_id, payload, total, created_at, updated_at, poll_message_id)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    ''', (original_message_id, sender_id, payload, total, datetime.now(), datetime.now(), poll_message_id))
+    conn.commit()
+    return cursor.lastrowid
+
+def update_outbox_progress(job_id, sent, failed, status=None):
+    flush_deliveries()
+    if status and status != 'pending':
+        # A finished job can no longer be resumed, and its payload holds the whole message
+        cursor.execute('DELETE FROM outbox WHERE job_id = ?', (job_id,))
+        cursor.execute('DELETE FROM outbox_shards WHERE job_id = ?', (job_id,))
+    elif status:
+        cursor.execute('UPDATE outbox SET sent = ?, failed = ?, status = ?, updated_at = ? WHERE job_id = ?', 
+                      (sent, failed, status, datetime.now(), job_id))
+    else:
+        cursor.execute('UPDATE outbox SET sent = ?, failed = ?, updated_at = ? WHERE job_id = ?', 
+                      (sent, failed, datetime.now(), job_id))
+    conn.commit()
+
+def get_pending_outbox_jobs():
+    cursor.execute('SELECT job_id, original_message_id, sender_id, payload, sent, failed, poll_message_id FROM outbox WHERE status = ? ORDER BY job_id', 
+                  ('pending',))
+    return cursor.fetchall()
+
+def get_shard_outbox_jobs(shard):
+    cursor.execute('''
+        SELECT o.job_id, o.original_message_id, o.sender_id, o.payload, COALESCE(s.sent, 0), COALESCE(s.failed, 0), o.poll_message_id
+        FROM outbox o
+        LEFT JOIN outbox_shards s ON s.job_id = o.job_id AND s.shard = ?
+        WHERE o.status = ? AND (s.status IS NULL OR s.status != ?)
+        ORDER BY o.job_id
+    ''', (shard, 'pending', 'done'))
+    return cursor.fetchall()
+
+def update_outbox_shard(job_id, shard, sent, failed, status='pending'):
+    flush_deliveries()
+    cursor.execute('''
+        INSERT INTO outbox_shards (job_id, shard, sent, failed, status, updated_at)
+        VALUES (?, ?, ?, ?, ?, ?)
+        ON CONFLICT(job_id, shard) DO UPDATE SET
+        sent = excluded.sent, failed = excluded.failed, status = excluded.status, updated_at = excluded.updated_at
+    ''', (job_id, shard, sent, failed, status, datetime.now()))
+    conn.commit()
+
+def finish_outbox_shard(job_id, shard, shards, sent, failed):
+    flush_deliveries()
+    update_outbox_shard(job_id, shard, sent, failed, 'done')
+    cursor.execute('SELECT COUNT(*), SUM(sent), SUM(failed) FROM outbox_shards WHERE job_id = ? AND status = ?', 
+                  (job_id, 'done'))
+    done_shards, total_sent, total_failed = cursor.fetchone()
+    if done_shards >= shards:
+        update_outbox_progress(job_id, total_sent, total_failed, 'done')
+
+def cleanup_outbox(days=1):
+    cutoff_time = datetime.now() - timedelta(days=days)
+    cursor.execute('DELETE FROM outbox WHERE status != ? AND updated_at < ?', ('pending', cutoff_time))
+    deleted = cursor.rowcount
+    cursor.execute('DELETE FROM outbox_shards WHERE job_id NOT IN (SELECT job_id FROM outbox)')
+    conn.commit()
+    return deleted
+
+def create_broadcast(creator_id, payload, text, pin, status_chat_id, status_message_id, status_is_caption):
+    cursor.execute('''
+        INSERT INTO broadcasts (creator_id, payload, text, pin, status_chat_id, status_message_id, status_is_caption, created_at, updated_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ''', (creator_id, payload, text, pin, status_chat_id, status_message_id, status_is_caption, datetime.now(), datetime.now()))
+    conn.commit()
+    return cursor.lastrowid
+
+def get_broadcast(broadcast_id):
+    cursor.execute('''
+        SELECT broadcast_id, creator_id, payload, text, pin, status, last_user_id, sent, failed, 
+               status_chat_id, status_message_id, status_is_caption 
+        FROM broadcasts WHERE broadcast_id = ?
+    ''', (broadcast_id,))
+    row = cursor.fetchone()
+    if row:
+        return {
+            'broadcast_id': row[0],
+            'creator_id': row[1],
+            'payload': row[2],
+            'text': row[3],
+            'pin': bool(row[4]),
+            'status': row[5],
+            'last_user_id': row[6],
+            'sent': row[7],
+            'failed': row[8],
+            'status_chat_id': row[9],
+            'status_message_id': row[10],
+            'status_is_caption': bool(row[11])
+        }
+    return None
+
+def update_broadcast(broadcast_id, updates: Dict[str, Any]):
+    updates = dict(updates, updated_at=datetime.now())
+    set_clause = ', '.join([f'{key} = ?' for key in updates.keys()])
+    values = list(updates.values())
+    values.append(broadcast_id)
+    cursor.execute(f'UPDATE broadcasts SET {set_clause} WHERE broadcast_id = ?', values)
+    conn.commit()
+
+def get_running_broadcasts():
+    cursor.execute('SELECT broadcast_id FROM broadcasts WHERE status = ? ORDER BY broadcast_id', ('running',))
+    return [row[0] for row in cursor.fetchall()]
+
 def get_original_message_info(message_id, user_id):
     cursor.execute('SELECT original_message_id, original_sender_id FROM messages WHERE message_id = ? AND user_id = ?', 
                   (message_id, user_id))
@@ -296,6 +769,7 @@ def get_message_content(original_message_id, user_id):
     return result[0] if result else None
 
 def update_message_content(original_message_id, new_content, is_edited=True):
+    flush_deliveries()
     if is_edited:
         cursor.execute('UPDATE messages SET content = ?, is_edited = 1, edited_at = ? WHERE original_message_id = ?', 
                       (new_content, datetime.now(), original_message_id))
@@ -305,6 +779,7 @@ def update_message_content(original_message_id, new_content, is_edited=True):
     conn.commit()
 
 def delete_messages_by_original(original_message_id, exclude_user_id=None):
+    flush_deliveries()
     if exclude_user_id:
         cursor.execute('DELETE FROM messages WHERE original_message_id = ? AND user_id != ?', 
                       (original_message_id, exclude_user_id))
@@ -317,18 +792,39 @@ def add_ignored_user(user_id, ignored_user_id):
     cursor.execute('INSERT OR IGNORE INTO ignored_users (user_id, ignored_user_id) VALUES (?, ?)', 
                   (user_id, ignored_user_id))
     conn.commit()
+    if ignored_by is not None:
+        ignored_by.setdefault(ignored_user_id, set()).add(user_id)
 
 def remove_ignored_user(user_id, ignored_user_id):
     cursor.execute('DELETE FROM ignored_users WHERE user_id = ? AND ignored_user_id = ?', 
                   (user_id, ignored_user_id))
     conn.commit()
+    if ignored_by is not None and ignored_user_id in ignored_by:
+        ignored_by[ignored_user_id].discard(user_id)
+
+def remove_all_ignored(user_id):
+    cursor.execute('SELECT ignored_user_id FROM ignored_users WHERE user_id = ?', (user_id,))
+    ignored = [row[0] for row in cursor.fetchall()]
+    cursor.execute('DELETE FROM ignored_users WHERE user_id = ?', (user_id,))
+    conn.commit()
+    if ignored_by is not None:
+        for ignored_user_id in ignored:
+            ignored_by.get(ignored_user_id, set()).discard(user_id)
+
+def get_users_ignoring(user_id) -> Set[int]:
+    if ignored_by is not None:
+        return ignored_by.get(user_id, set())
+    cursor.execute('SELECT user_id FROM ignored_users WHERE ignored_user_id = ?', (user_id,))
+    return {row[0] for row in cursor.fetchall()}
 
-def is_ignored(user_id, target_user_id):
-    cursor.execute('SELECT 1 FROM ignored_users WHERE user_id = ? AND ignored_user_id = ?', 
-                  (user_id, target_user_id))
-    return cursor.fetchone() is not None
+def load_bot_settings():
+    global bot_settings
+    cursor.execute('SELECT key, value FROM bot_settings')
+    bot_settings = dict(cursor.fetchall())
 
 def get_bot_setting(key, default=None):
+    if bot_settings is not None:
+        return bot_settings.get(key, default)
     cursor.execute('SELECT value FROM bot_settings WHERE key = ?', (key,))
     result = cursor.fetchone()
     return result[0] if result else default
@@ -336,12 +832,19 @@ def get_bot_setting(key, default=None):
 def set_bot_setting(key, value):
     cursor.execute('INSERT OR REPLACE INTO bot_settings (key, value) VALUES (?, ?)', (key, value))
     conn.commit()
+    global bot_settings
+    if bot_settings is not None:
+        bot_settings = dict(bot_settings, **{key: value})
 
 def add_warning(user_id, admin_id, reason):
     cursor.execute('INSERT INTO warnings (user_id, admin_id, reason) VALUES (?, ?, ?)', 
                   (user_id, admin_id, reason))
     conn.commit()
 
+def remove_last_warning(user_id):
+    cursor.execute('DELETE FROM warnings WHERE user_id = ? AND id = (SELECT MAX(id) FROM warnings WHERE user_id = ?)', (user_id, user_id))
+    conn.commit()
+
 def get_top_users(limit=5):
     cursor.execute('''
         SELECT user_id, message_count, encrypted_name, encrypted_username, tag_enabled, tag_text, 
@@ -372,35 +875,66 @@ def get_total_messages():
     cursor.execute('SELECT COUNT(*) FROM messages')
     return cursor.fetchone()[0]
 
-def cleanup_old_messages():
-    cursor.execute('SELECT user_id, autodel_time FROM users WHERE autodel_time > 0')
-    users_with_autodel = cursor.fetchall()
-    
-    deleted_count = 0
-    for user_id, autodel_time in users_with_autodel:
-        cutoff_time = datetime.now() - timedelta(minutes=autodel_time)
-        
-        cursor.execute('''
-            SELECT m.user_id, m.message_id 
-            FROM messages m
-            WHERE m.original_sender_id = ? AND m.created_at < ?
-        ''', (user_id, cutoff_time))
-        
-        old_messages = cursor.fetchall()
-        
-        cursor.execute('DELETE FROM messages WHERE original_sender_id = ? AND created_at < ?', (user_id, cutoff_time))
-        cursor.execute('DELETE FROM message_map WHERE user_message_id IN (SELECT original_message_id FROM messages WHERE original_sender_id = ? AND created_at < ?)', (user_id, cutoff_time))
-        deleted_count += len(old_messages)
+def pop_expired_messages(now, limit=CLEANUP_CHUNK):
+    flush_deliveries()
+    cursor.execute('SELECT rowid, user_id, message_id, original_message_id FROM messages WHERE expires_at <= ? ORDER BY expires_at LIMIT ?',
+                  (now, limit))
+    expired = cursor.fetchall()
+    if not expired:
+        return [], {'messages': 0, 'message_map': 0}
     
+    cursor.executemany('DELETE FROM message_map WHERE user_message_id = ? AND target_user_id = ?',
+                       [(original_message_id, user_id) for rowid, user_id, message_id, original_message_id in expired])
+    map_deleted = cursor.rowcount
+    cursor.execute(f'DELETE FROM messages WHERE rowid IN ({",".join("?" * len(expired))})', [row[0] for row in expired])
+    messages_deleted = cursor.rowcount
     conn.commit()
-    return deleted_count
+    return [(user_id, message_id) for rowid, user_id, message_id, original_message_id in expired], {'messages': messages_deleted, 'message_map': map_deleted}
+
+def get_next_expiry():
+    cursor.execute('SELECT MIN(expires_at) FROM messages')
+    result = cursor.fetchone()
+    return datetime.fromisoformat(result[0]) if result and result[0] else None
+
+def set_message_expiry(sender_id, minutes):
+    flush_deliveries()
+    if minutes:
+        cursor.execute("UPDATE messages SET expires_at = strftime('%Y-%m-%dT%H:%M:%S', created_at, ?, 'localtime') WHERE original_sender_id = ?",
+                      (f'+{minutes} minutes', sender_id))
+    else:
+        cursor.execute('UPDATE messages SET expires_at = NULL WHERE original_sender_id = ?', (sender_id,))
+    conn.commit()
+
+def delete_in_chunks(table, where, params):
+    deleted = 0
+    while True:
+        cursor.execute(f'DELETE FROM {table} WHERE rowid IN (SELECT rowid FROM {table} WHERE {where} LIMIT ?)', (*params, CLEANUP_CHUNK))
+        deleted += cursor.rowcount
+        conn.commit()
+        if cursor.rowcount < CLEANUP_CHUNK:
+            return deleted
+
+def cleanup_old_data(days=30):
+    flush_deliveries()
+    # created_at is filled by CURRENT_TIMESTAMP, which is UTC in "YYYY-MM-DD HH:MM:SS" form
+    cutoff = (datetime.now(timezone.utc) - timedelta(days=days)).strftime('%Y-%m-%d %H:%M:%S')
+    
+    return {
+        'message_map': delete_in_chunks('message_map', 'created_at < ?', (cutoff,)),
+        'messages': delete_in_chunks('messages', 'created_at < ?', (cutoff,)),
+        'stats': delete_in_chunks('stats', 'date < ?', (cutoff[:10],))
+    }
 
 def delete_user_data(user_id):
+    flush_deliveries()
     cursor.execute('DELETE FROM users WHERE user_id = ?', (user_id,))
     cursor.execute('DELETE FROM messages WHERE user_id = ?', (user_id,))
-    cursor.execute('DELETE FROM ignored_users WHERE user_id = ?', (user_id,))
     cursor.execute('DELETE FROM user_stats WHERE user_id = ?', (user_id,))
     conn.commit()
+    invalidate_users([user_id])
+    remove_all_ignored(user_id)
+    if active_users is not None:
+        active_users.discard(user_id)
 
 def get_bot_start_time():
     result = get_bot_setting('bot_start_time')
@@ -431,4 +965,44 @@ def validate_tag_text(text):
     if not pattern.match(text):
         return False
     
-    return True
\ No newline at end of file
+    return True
+
+# Functions that only read the database run on the reader pool, everything else on the writer thread
+READ_FUNCTIONS = {
+    'get_user', 'get_active_users', 'get_admin_users', 'get_users_ignoring', 'get_bot_setting',
+    'get_top_users', 'get_daily_stats', 'get_user_daily_stats', 'get_total_users', 'get_broadcast',
+    'get_running_broadcasts', 'get_pending_outbox_jobs', 'get_shard_outbox_jobs'
+}
+# Reads of messages/message_map; the delivery buffer is flushed on the writer before they run
+FLUSHED_READ_FUNCTIONS = {
+    'get_message_map', 'get_message_map_targets', 'get_delivered_user_ids', 'get_original_message_info',
+    'get_messages_by_original', 'get_message_content', 'get_original_sender_id', 'get_total_messages', 'get_next_expiry'
+}
+
+class AsyncDatabase:
+    def __getattr__(self, name):
+        function = globals()[name]
+        needs_flush = name in FLUSHED_READ_FUNCTIONS
+        is_read = needs_flush or name in READ_FUNCTIONS
+
+        async def call(*args, **kwargs):
+            loop = asyncio.get_running_loop()
+            if needs_flush and (pending_messages or flush_running):
+                await loop.run_in_executor(writer, flush_deliveries)
+            executor = readers if is_read and readers else writer
+            return await loop.run_in_executor(executor, functools.partial(function, *args, **kwargs))
+
+        setattr(self, name, call)
+        return call
+
+db = AsyncDatabase()
+
+def shutdown():
+    global flush_handle
+    if flush_handle:
+        flush_handle.cancel()
+        flush_handle = None
+    writer.submit(flush_deliveries)
+    writer.shutdown(wait=True)
+    if readers:
+        readers.shutdown(wait=True)
@@ -0,0 +1,434 @@
+# delivery.py
+import asyncio
+import contextvars
+import os
+import random
+import subprocess
+import sys
+import time
+import logging
+from collections import deque
+from contextlib import contextmanager
+from typing import Dict, Optional, Callable, Awaitable, Iterable, List, Tuple
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.methods import GetUpdates, DeleteWebhook, GetMe, AnswerCallbackQuery
+from aiogram.exceptions import TelegramRetryAfter, TelegramNetworkError, TelegramServerError, TelegramForbiddenError, TelegramBadRequest
+import storage
+
+logger = logging.getLogger(__name__)
+
+# Interactive replies are always served first, the bulk lanes share the rest by weight
+LANES = ('interactive', 'echo', 'fanout', 'broadcast')
+LANE_WEIGHTS = {'echo': 8, 'fanout': 4, 'broadcast': 1}
+
+TRANSIENT_ERRORS = (TelegramNetworkError, TelegramServerError, asyncio.TimeoutError)
+MAX_ATTEMPTS = 5
+UNREACHABLE_ERRORS = ('blocked', 'deactivated', 'chat_not_found')
+# deleteMessages accepts at most 100 ids per call
+DELETE_BATCH = 100
+# Seconds of send history kept for the /status rate
+RATE_WINDOW = 10.0
+
+current_lane = contextvars.ContextVar('delivery_lane', default='interactive')
+
+def classify_error(error: Exception) -> str:
+    description = str(error).lower()
+    if isinstance(error, TelegramRetryAfter):
+        return 'flood_wait'
+    if isinstance(error, TelegramForbiddenError):
+        if 'deactivated' in description:
+            return 'deactivated'
+        return 'blocked'
+    if isinstance(error, TelegramBadRequest):
+        if 'chat not found' in description or 'user not found' in description:
+            return 'chat_not_found'
+        return 'bad_request'
+    if isinstance(error, TRANSIENT_ERRORS):
+        return 'network'
+    return 'other'
+
+@contextmanager
+def lane(name: str):
+    token = current_lane.set(name)
+    try:
+        yield
+    finally:
+        current_lane.reset(token)
+
+def pick_lane(queues: Dict[str, deque], credit: Dict[str, int]) -> Optional[str]:
+    if queues['interactive']:
+        return 'interactive'
+
+    candidates = [name for name in LANE_WEIGHTS if queues[name]]
+    if not candidates:
+        return None
+
+    total = sum(LANE_WEIGHTS[name] for name in candidates)
+    for name in candidates:
+        credit[name] += LANE_WEIGHTS[name]
+    best = max(candidates, key=lambda name: credit[name])
+    credit[best] -= total
+    return best
+
+class LaneLimiter:
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.waiters = {name: deque() for name in LANES}
+        self.credit = {name: 0 for name in LANE_WEIGHTS}
+        self.dispatcher: Optional[asyncio.Task] = None
+        self.paused_until = {name: 0.0 for name in LANES}
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def pause(self, seconds: float, lane_name: str = 'interactive'):
+        until = time.monotonic() + seconds
+        # A flood wait on a bulk send holds only that lane, so direct replies keep flowing;
+        # one on an interactive send stops everything
+        if lane_name != 'interactive':
+            self.paused_until[lane_name] = max(self.paused_until[lane_name], until)
+            return
+        for name in LANES:
+            self.paused_until[name] = max(self.paused_until[name], until)
+        self.tokens = 0
+
+    def _drop_cancelled(self):
+        for waiters in self.waiters.values():
+            while waiters and waiters[0].done():
+                waiters.popleft()
+
+    async def acquire(self, lane_name: str = 'interactive'):
+        self._refill()
+        self._drop_cancelled()
+        if self.tokens >= 1 and not any(self.waiters.values()) and time.monotonic() >= self.paused_until[lane_name]:
+            self.tokens -= 1
+            return
+
+        future = asyncio.get_running_loop().create_future()
+        self.waiters[lane_name].append(future)
+        if not self.dispatcher or self.dispatcher.done():
+            self.dispatcher = asyncio.create_task(self._dispatch())
+        await future
+
+    async def _dispatch(self):
+        while True:
+            self._drop_cancelled()
+            now = time.monotonic()
+            ready = {name: waiters if now >= self.paused_until[name] else () for name, waiters in self.waiters.items()}
+            if not any(ready.values()):
+                paused = [self.paused_until[name] for name, waiters in self.waiters.items() if waiters]
+                if not paused:
+                    return
+                await asyncio.sleep(min(paused) - now)
+                continue
+
+            self._refill()
+            if self.tokens < 1:
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+                continue
+
+            name = pick_lane(ready, self.credit)
+            self.tokens -= 1
+            self.waiters[name].popleft().set_result(None)
+
+class AdaptiveLimit:
+    def __init__(self, initial: int, minimum: int, maximum: int):
+        self.limit = float(initial)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.active = 0
+        self.last_decrease = 0.0
+        self.changed = asyncio.Condition()
+
+    async def acquire(self):
+        async with self.changed:
+            await self.changed.wait_for(lambda: self.active < int(self.limit))
+            self.active += 1
+
+    async def release(self):
+        async with self.changed:
+            self.active -= 1
+            self.changed.notify()
+
+    def increase(self):
+        # Roughly +1 slot per round of successful sends
+        self.limit = min(self.maximum, self.limit + 1 / self.limit)
+
+    def decrease(self):
+        # A burst of flood-waits from parallel workers counts as one signal
+        now = time.monotonic()
+        if now - self.last_decrease < 1.0:
+            return
+        self.last_decrease = now
+        self.limit = max(self.minimum, self.limit / 2)
+        logger.warning(f"Flood wait received, delivery concurrency lowered to {int(self.limit)}")
+
+class ChatPacer:
+    def __init__(self, interval: float):
+        self.interval = interval
+        self.next_slot: Dict[int, float] = {}
+
+    async def wait(self, chat_id: int):
+        now = time.monotonic()
+        if len(self.next_slot) > 10000:
+            self.next_slot = {k: v for k, v in self.next_slot.items() if v > now}
+        slot = max(now, self.next_slot.get(chat_id, 0))
+        self.next_slot[chat_id] = slot + self.interval
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+class Fanout:
+    def __init__(self, name: str, total: int, progress: Optional[Callable[['Fanout'], None]] = None, progress_every: int = 100):
+        self.name = name
+        self.total = total
+        self.progress = progress
+        self.progress_every = progress_every
+        self.sent = 0
+        self.failed = 0
+        self.cancelled = False
+        self.errors: Dict[str, int] = {}
+        self.unreachable: List[int] = []
+        self.started = time.monotonic()
+        self.finished: Optional[float] = None
+        self.done = asyncio.Event()
+        if total == 0:
+            self._finish()
+
+    def _finish(self):
+        self.finished = time.monotonic()
+        self.done.set()
+
+    def record(self, ok: bool, chat_id: Optional[int] = None, error: Optional[str] = None):
+        if ok:
+            self.sent += 1
+        else:
+            self.failed += 1
+            if error:
+                self.errors[error] = self.errors.get(error, 0) + 1
+                if error in UNREACHABLE_ERRORS and chat_id is not None:
+                    self.unreachable.append(chat_id)
+        done = self.sent + self.failed
+        if done >= self.total:
+            self._finish()
+        elif self.progress and done % self.progress_every == 0:
+            try:
+                self.progress(self)
+            except Exception as e:
+                logger.error(f"{self.name}: progress callback failed: {e}")
+
+    @property
+    def elapsed(self) -> float:
+        return (self.finished or time.monotonic()) - self.started
+
+    @property
+    def rate(self) -> float:
+        elapsed = self.elapsed
+        return self.sent / elapsed if elapsed > 0 else 0.0
+
+class DeliveryScheduler:
+    def __init__(self):
+        self.limiter: Optional[LaneLimiter] = None
+        self.concurrency: Optional[AdaptiveLimit] = None
+        self.pacer: Optional[ChatPacer] = None
+        self.jobs = {name: deque() for name in LANES}
+        self.job_credit = {name: 0 for name in LANE_WEIGHTS}
+        self.job_count: Optional[asyncio.Semaphore] = None
+        self.workers: List[asyncio.Task] = []
+        self.sent_times = deque()
+
+    def start(self, share: float = 1.0):
+        if self.workers:
+            return
+        # Telegram allows about 30 messages per second overall and 1 per second per chat
+        rate = float(os.getenv('DELIVERY_RATE', '30')) * share
+        burst = max(1.0, float(os.getenv('DELIVERY_BURST', '5')) * share)
+        chat_interval = float(os.getenv('DELIVERY_CHAT_INTERVAL', '1.0'))
+        workers = max(1, int(int(os.getenv('DELIVERY_WORKERS', '30')) * share))
+        self.limiter = LaneLimiter(rate, burst)
+        self.concurrency = AdaptiveLimit(max(1, workers // 2), 1, workers)
+        self.pacer = ChatPacer(chat_interval)
+        self.job_count = asyncio.Semaphore(0)
+        self.workers = [asyncio.create_task(self._worker()) for _ in range(workers)]
+        logger.info(f"Delivery scheduler started: {rate} msg/s, {workers} workers")
+
+    async def stop(self):
+        for worker in self.workers:
+            worker.cancel()
+        await asyncio.gather(*self.workers, return_exceptions=True)
+        self.workers = []
+
+    async def _worker(self):
+        while True:
+            await self.job_count.acquire()
+            fanout, chat_id, send, lane_name = self.jobs[pick_lane(self.jobs, self.job_credit)].popleft()
+            if fanout.cancelled:
+                continue
+            ok = False
+            error = None
+            try:
+                ok = await self._deliver(chat_id, send, lane_name)
+            except Exception as e:
+                error = classify_error(e)
+                logger.debug(f"{fanout.name}: delivery to {chat_id} failed: {e}")
+            finally:
+                if ok:
+                    self.sent_times.append(time.monotonic())
+                    self._trim_sent_times()
+                fanout.record(ok, chat_id, error)
+
+    async def _deliver(self, chat_id: int, send: Callable[[int], Awaitable[bool]], lane_name: str) -> bool:
+        for attempt in range(1, MAX_ATTEMPTS + 1):
+            await self.pacer.wait(chat_id)
+            await self.concurrency.acquire()
+            try:
+                with lane(lane_name):
+                    ok = bool(await send(chat_id))
+                self.concurrency.increase()
+                return ok
+            except TelegramRetryAfter as e:
+                if attempt == MAX_ATTEMPTS:
+                    raise
+                self.concurrency.decrease()
+                self.limiter.pause(e.retry_after, lane_name)
+                delay = e.retry_after
+            except TRANSIENT_ERRORS:
+                if attempt == MAX_ATTEMPTS:
+                    raise
+                delay = min(30, 2 ** attempt) * random.uniform(0.5, 1.5)
+            finally:
+                await self.concurrency.release()
+            await asyncio.sleep(delay)
+        return False
+
+    async def fanout(self, chat_ids: Iterable[int], send: Callable[[int], Awaitable[bool]], name: str = "Fan-out",
+                     progress: Optional[Callable[[Fanout], None]] = None, progress_every: int = 100,
+                     lane_name: str = 'fanout', lanes: Optional[Dict[int, str]] = None, fanout: Optional[Fanout] = None) -> Fanout:
+        chat_ids = list(chat_ids)
+        if not fanout:
+            fanout = Fanout(name, len(chat_ids), progress, progress_every)
+        if not chat_ids:
+            return fanout
+        self.start()
+        for chat_id in chat_ids:
+            job_lane = lanes.get(chat_id, lane_name) if lanes else lane_name
+            self.jobs[job_lane].append((fanout, chat_id, send, job_lane))
+            self.job_count.release()
+        try:
+            await fanout.done.wait()
+        except asyncio.CancelledError:
+            fanout.cancelled = True
+            raise
+        logger.info(f"{name}: {fanout.sent} sent, {fanout.failed} failed in {fanout.elapsed:.1f}s ({fanout.rate:.1f} msg/s)")
+        if fanout.errors:
+            logger.info(f"{name}: errors {fanout.errors}")
+        if fanout.unreachable:
+            await storage.db.mark_unreachable(fanout.unreachable)
+            logger.info(f"{name}: {len(fanout.unreachable)} recipients marked unreachable")
+        return fanout
+
+    def _trim_sent_times(self):
+        cutoff = time.monotonic() - RATE_WINDOW
+        while self.sent_times and self.sent_times[0] < cutoff:
+            self.sent_times.popleft()
+
+    def current_rate(self) -> float:
+        self._trim_sent_times()
+        return len(self.sent_times) / RATE_WINDOW
+
+    def concurrency_limit(self) -> int:
+        return int(self.concurrency.limit) if self.concurrency else 0
+
+    def backlog(self) -> Dict[str, int]:
+        return {name: len(jobs) for name, jobs in self.jobs.items() if jobs}
+
+scheduler = DeliveryScheduler()
+
+async def delete_messages(bot, messages: Iterable[Tuple[int, int]], name: str = "Delete") -> int:
+    by_chat: Dict[int, List[int]] = {}
+    for chat_id, message_id in messages:
+        by_chat.setdefault(chat_id, []).append(message_id)
+
+    deleted = 0
+    # Retries of a chat resume after the last batch that went through
+    done_upto: Dict[int, int] = {}
+
+    async def delete(chat_id):
+        nonlocal deleted
+        message_ids = by_chat[chat_id]
+        for start in range(done_upto.get(chat_id, 0), len(message_ids), DELETE_BATCH):
+            batch = message_ids[start:start + DELETE_BATCH]
+            await bot.delete_messages(chat_id, batch)
+            done_upto[chat_id] = start + len(batch)
+            deleted += len(batch)
+        return True
+
+    await scheduler.fanout(by_chat, delete, name)
+    return deleted
+
+worker_processes: List[subprocess.Popen] = []
+resync_task: Optional[asyncio.Task] = None
+
+# Worker processes mark unreachable users only in the database, so the main process
+# reloads its active-recipient set while they run
+ACTIVE_RESYNC_INTERVAL = 60
+
+def process_count() -> int:
+    if not storage.db.shared:
+        return 0
+    return int(os.getenv('DELIVERY_PROCESSES', '0'))
+
+def reserved_share() -> float:
+    # The main process keeps part of the bot-wide rate for broadcasts, edits, deletes and replies;
+    # worker processes split the rest, so together they stay under DELIVERY_RATE
+    return min(0.9, max(0.1, float(os.getenv('DELIVERY_MAIN_SHARE', '0.3'))))
+
+def main_share() -> float:
+    return reserved_share() if process_count() else 1.0
+
+def worker_share(shards: int) -> float:
+    return (1.0 - reserved_share()) / shards
+
+def start_processes():
+    global resync_task
+    shards = process_count()
+    worker_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'worker.py')
+    for shard in range(shards):
+        worker_processes.append(subprocess.Popen([sys.executable, worker_path, str(shard), str(shards)]))
+    if shards:
+        resync_task = asyncio.create_task(resync_active_users())
+        logger.info(f"Started {shards} delivery worker processes")
+
+async def resync_active_users():
+    while True:
+        await asyncio.sleep(ACTIVE_RESYNC_INTERVAL)
+        try:
+            await storage.db.load_active_users()
+        except Exception as e:
+            logger.error(f"Active users resync failed: {e}")
+
+def stop_processes():
+    global resync_task
+    if resync_task:
+        resync_task.cancel()
+        resync_task = None
+    for process in worker_processes:
+        process.terminate()
+    for process in worker_processes:
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+    worker_processes.clear()
+
+class LaneMiddleware(BaseRequestMiddleware):
+    unthrottled = (GetUpdates, DeleteWebhook, GetMe, AnswerCallbackQuery)
+
+    async def __call__(self, make_request, bot, method):
+        if scheduler.limiter and not isinstance(method, self.unthrottled):
+            await scheduler.limiter.acquire(current_lane.get())
+        return await make_request(bot, method)
@@ -0,0 +1,86 @@
+# expiry.py
+import asyncio
+import heapq
+import logging
+from datetime import datetime
+from typing import List, Optional
+from aiogram import Bot
+import database
+import storage
+import delivery
+
+logger = logging.getLogger(__name__)
+
+# Deadlines written by delivery worker processes are only visible through the database
+RESYNC_INTERVAL = 60
+
+class ExpiryScheduler:
+    def __init__(self):
+        self.deadlines: List[datetime] = []
+        self.wakeup: Optional[asyncio.Event] = None
+        self.task: Optional[asyncio.Task] = None
+
+    def start(self, bot: Bot):
+        if self.task:
+            return
+        self.wakeup = asyncio.Event()
+        self.task = asyncio.create_task(self.run(bot))
+
+    async def stop(self):
+        if not self.task:
+            return
+        self.task.cancel()
+        await asyncio.gather(self.task, return_exceptions=True)
+        self.task = None
+        self.wakeup = None
+
+    def schedule(self, deadline: Optional[datetime]):
+        if not deadline or not self.wakeup:
+            return
+        if not self.deadlines or deadline < self.deadlines[0]:
+            self.wakeup.set()
+        heapq.heappush(self.deadlines, deadline)
+
+    async def refresh(self):
+        deadline = await storage.db.get_next_expiry()
+        if deadline and (not self.deadlines or deadline < self.deadlines[0]):
+            self.schedule(deadline)
+
+    async def run(self, bot: Bot):
+        await self.refresh()
+        while True:
+            timeout = RESYNC_INTERVAL
+            if self.deadlines:
+                timeout = min(timeout, max(0.0, (self.deadlines[0] - datetime.now()).total_seconds()))
+
+            self.wakeup.clear()
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), timeout)
+                continue
+            except asyncio.TimeoutError:
+                pass
+
+            now = datetime.now()
+            while self.deadlines and self.deadlines[0] <= now:
+                heapq.heappop(self.deadlines)
+
+            try:
+                expired = []
+                counts = {'messages': 0, 'message_map': 0}
+                while True:
+                    chunk, deleted = await storage.db.pop_expired_messages(now)
+                    expired.extend(chunk)
+                    for table, count in deleted.items():
+                        counts[table] += count
+                    if len(chunk) < database.CLEANUP_CHUNK:
+                        break
+                    await asyncio.sleep(0)
+
+                if expired:
+                    removed = await delivery.delete_messages(bot, expired, "Autodel")
+                    logger.info(f"Autodel: removed {counts['messages']} messages and {counts['message_map']} map rows, {removed} deleted in Telegram")
+                await self.refresh()
+            except Exception as e:
+                logger.error(f"Autodel failed: {e}")
+
+scheduler = ExpiryScheduler()
@@ -5,6 +5,7 @@ from aiogram.utils.keyboard import InlineKeyboardBuilder
 from aiogram.types import FSInputFile
 import os
 import database
+import storage
 
 def create_system_keyboard():
     builder = InlineKeyboardBuilder()
@@ -13,9 +14,9 @@ def create_system_keyboard():
 
 async def show_help_command(message: types.Message, bot):
     user_id = message.from_user.id
-    user = database.get_user(user_id)
+    user = await storage.db.get_user(user_id)
     
-    if not user or not user['captcha_passed']:
+    if not user or not user.captcha_passed:
         return
     
     builder = InlineKeyboardBuilder()
@@ -42,7 +43,7 @@ async def show_help_command(message: types.Message, bot):
     
     builder.adjust(4, 4, 4, 2)
     
-    if user and (user['is_admin'] or user['is_creator'] or user['is_coowner']):
+    if user and (user.is_admin or user.is_creator or user.is_coowner):
         builder.button(text="➖➖➖➖➖➖➖", callback_data="help_none")
         builder.adjust(1)
         
@@ -60,14 +61,14 @@ async def show_help_command(message: types.Message, bot):
             ("/calldown", "help_calldown"),
         ]
         
-        if user['is_creator']:
+        if user.is_creator:
             admin_commands.append(("/bc", "help_bc"))
         
         for cmd, callback in admin_commands:
             builder.button(text=cmd, callback_data=callback)
         builder.adjust(4, 4, 4)
     
-    if user and user['is_creator']:
+    if user and user.is_creator:
         builder.button(text="➖➖➖➖➖➖➖", callback_data="help_none")
         builder.adjust(1)
         
@@ -166,9 +167,9 @@ async def show_help_detail(query: types.CallbackQuery, bot):
 
 async def show_autodel_options(message: types.Message):
     user_id = message.from_user.id
-    user = database.get_user(user_id)
+    user = await storage.db.get_user(user_id)
     
-    if not user or not user['captcha_passed']:
+    if not user or not user.captcha_passed:
         return
     
     builder = InlineKeyboardBuilder()
@@ -181,36 +182,36 @@ async def show_autodel_options(message: types.Message):
     builder.adjust(2)
     await message.answer("Выберите время автоудаления:", reply_markup=builder.as_markup())
 
-def create_message_keyboard(sender_user: dict, target_user_id: int, is_sender: bool, is_paid_media: bool = False, original_message_id: int = None):
+def create_message_keyboard(sender_user: database.UserRecord, target_user_id: int, is_sender: bool, is_paid_media: bool = False, original_message_id: int = None):
     builder = InlineKeyboardBuilder()
     
-    if sender_user['tag_enabled'] and not is_paid_media:
-        if sender_user['tag_text']:
-            tag_text = sender_user['tag_text']
-        elif sender_user['encrypted_name']:
+    if sender_user.tag_enabled and not is_paid_media:
+        if sender_user.tag_text:
+            tag_text = sender_user.tag_text
+        elif sender_user.encrypted_name:
             try:
-                tag_text = database.decrypt_text(sender_user['encrypted_name'])
+                tag_text = database.decrypt_text(sender_user.encrypted_name)
             except:
                 tag_text = "Пользователь"
         else:
             tag_text = "Пользователь"
         
-        builder.button(text=tag_text, url=f"tg://user?id={sender_user['user_id']}")
+        builder.button(text=tag_text, url=f"tg://user?id={sender_user.user_id}")
     
-    if sender_user['custom_tag_enabled'] and sender_user['custom_tag']:
-        builder.button(text=sender_user['custom_tag'], callback_data="none")
+    if sender_user.custom_tag_enabled and sender_user.custom_tag:
+        builder.button(text=sender_user.custom_tag, callback_data="none")
     
-    if sender_user['admin_tag_enabled'] and (sender_user['is_admin'] or sender_user['is_coowner']):
+    if sender_user.admin_tag_enabled and (sender_user.is_admin or sender_user.is_coowner):
         builder.button(text="Администратор", url="https://t.me/FerumEAterms/3")
     
-    if sender_user['creator_tag_enabled'] and sender_user['is_creator']:
+    if sender_user.creator_tag_enabled and sender_user.is_creator:
         builder.button(text="Создатель", url="https://t.me/FerumEAterms/2")
     
-    if sender_user['is_coowner']:
+    if sender_user.is_coowner:
         builder.button(text="Co-Owner", url="https://t.me/FerumEAterms/5")
     
     if is_sender and not is_paid_media and original_message_id:
-        builder.button(text="Удалить мое сообщение", callback_data=f"delmy_{sender_user['user_id']}_{original_message_id}")
+        builder.button(text="Удалить мое сообщение", callback_data=f"delmy_{sender_user.user_id}_{original_message_id}")
     
     if builder.buttons:
         builder.adjust(1)
@@ -0,0 +1,812 @@
+# storage.py
+import heapq
+import itertools
+import logging
+import os
+from abc import ABC, abstractmethod
+from datetime import datetime, timedelta
+from typing import Optional, Dict, Any, List, Tuple, Set
+import database
+
+logger = logging.getLogger(__name__)
+
+class Storage(ABC):
+    # Multi-process delivery needs storage shared between processes
+    shared = True
+
+    @abstractmethod
+    def initialize(self):
+        ...
+
+    @abstractmethod
+    def shutdown(self):
+        ...
+
+    # users
+    @abstractmethod
+    async def get_user(self, user_id: int, columns: Tuple[str, ...] = database.USER_COLUMNS) -> Optional[database.UserRecord]:
+        ...
+
+    @abstractmethod
+    async def create_user(self, user_id: int, language_code: str):
+        ...
+
+    @abstractmethod
+    async def grant_role(self, user_id: int, role: str):
+        ...
+
+    @abstractmethod
+    async def update_user(self, user_id: int, updates: Dict[str, Any]):
+        ...
+
+    @abstractmethod
+    async def update_stats(self, user_id: int):
+        ...
+
+    @abstractmethod
+    async def get_active_users(self) -> List[int]:
+        ...
+
+    @abstractmethod
+    async def load_active_users(self):
+        ...
+
+    @abstractmethod
+    async def mark_unreachable(self, user_ids: List[int]):
+        ...
+
+    @abstractmethod
+    async def get_admin_users(self) -> List[int]:
+        ...
+
+    @abstractmethod
+    async def get_top_users(self, limit: int = 5) -> List[tuple]:
+        ...
+
+    @abstractmethod
+    async def get_total_users(self) -> int:
+        ...
+
+    @abstractmethod
+    async def delete_user_data(self, user_id: int):
+        ...
+
+    # messages and message maps
+    @abstractmethod
+    def save_delivery(self, message_data: Dict[str, Any]):
+        ...
+
+    @abstractmethod
+    async def flush_deliveries(self):
+        ...
+
+    @abstractmethod
+    async def save_message_map(self, original_message_id: int, target_user_id: int, target_message_id: int):
+        ...
+
+    @abstractmethod
+    async def get_message_map(self, original_message_id: int, target_user_id: int) -> Optional[int]:
+        ...
+
+    @abstractmethod
+    async def get_message_map_targets(self, original_message_id: int) -> Dict[int, int]:
+        ...
+
+    @abstractmethod
+    async def get_delivered_user_ids(self, original_sender_id: int, original_message_id: int) -> Set[int]:
+        ...
+
+    @abstractmethod
+    async def get_original_message_info(self, message_id: int, user_id: int) -> Optional[Tuple[int, int]]:
+        ...
+
+    @abstractmethod
+    async def get_messages_by_original(self, original_message_id: int) -> List[tuple]:
+        ...
+
+    @abstractmethod
+    async def get_message_content(self, original_message_id: int, user_id: int) -> Optional[str]:
+        ...
+
+    @abstractmethod
+    async def update_message_content(self, original_message_id: int, new_content: str, is_edited: bool = True):
+        ...
+
+    @abstractmethod
+    async def delete_messages_by_original(self, original_message_id: int, exclude_user_id: Optional[int] = None):
+        ...
+
+    @abstractmethod
+    async def get_original_sender_id(self, original_message_id: int) -> Optional[int]:
+        ...
+
+    @abstractmethod
+    async def get_total_messages(self) -> int:
+        ...
+
+    @abstractmethod
+    async def pop_expired_messages(self, now: datetime, limit: int = database.CLEANUP_CHUNK) -> Tuple[List[Tuple[int, int]], Dict[str, int]]:
+        ...
+
+    @abstractmethod
+    async def get_next_expiry(self) -> Optional[datetime]:
+        ...
+
+    @abstractmethod
+    async def set_message_expiry(self, sender_id: int, minutes: int):
+        ...
+
+    @abstractmethod
+    async def cleanup_old_data(self, days: int = 30) -> Dict[str, int]:
+        ...
+
+    # delivery outbox
+    @abstractmethod
+    async def create_outbox_job(self, original_message_id: int, sender_id: int, payload: str, total: int,
+                                poll_message_id: Optional[int] = None) -> int:
+        ...
+
+    @abstractmethod
+    async def update_outbox_progress(self, job_id: int, sent: int, failed: int, status: Optional[str] = None):
+        ...
+
+    @abstractmethod
+    def checkpoint_outbox(self, job_id: int, sent: int, failed: int, shard: Optional[int] = None):
+        ...
+
+    @abstractmethod
+    async def get_pending_outbox_jobs(self) -> List[tuple]:
+        ...
+
+    @abstractmethod
+    async def get_shard_outbox_jobs(self, shard: int) -> List[tuple]:
+        ...
+
+    @abstractmethod
+    async def update_outbox_shard(self, job_id: int, shard: int, sent: int, failed: int, status: str = 'pending'):
+        ...
+
+    @abstractmethod
+    async def finish_outbox_shard(self, job_id: int, shard: int, shards: int, sent: int, failed: int):
+        ...
+
+    @abstractmethod
+    async def cleanup_outbox(self, days: int = 1) -> int:
+        ...
+
+    # broadcasts
+    @abstractmethod
+    async def create_broadcast(self, creator_id: int, payload: str, text: str, pin: int,
+                               status_chat_id: int, status_message_id: int, status_is_caption: int) -> int:
+        ...
+
+    @abstractmethod
+    async def get_broadcast(self, broadcast_id: int) -> Optional[Dict[str, Any]]:
+        ...
+
+    @abstractmethod
+    async def update_broadcast(self, broadcast_id: int, updates: Dict[str, Any]):
+        ...
+
+    @abstractmethod
+    async def get_running_broadcasts(self) -> List[int]:
+        ...
+
+    # ignores
+    @abstractmethod
+    async def add_ignored_user(self, user_id: int, ignored_user_id: int):
+        ...
+
+    @abstractmethod
+    async def remove_ignored_user(self, user_id: int, ignored_user_id: int):
+        ...
+
+    @abstractmethod
+    async def remove_all_ignored(self, user_id: int):
+        ...
+
+    @abstractmethod
+    async def get_users_ignoring(self, user_id: int) -> Set[int]:
+        ...
+
+    # stats
+    @abstractmethod
+    async def get_daily_stats(self) -> int:
+        ...
+
+    @abstractmethod
+    async def get_user_daily_stats(self, user_id: int) -> int:
+        ...
+
+    # settings
+    @abstractmethod
+    async def get_bot_setting(self, key: str, default: Optional[str] = None) -> Optional[str]:
+        ...
+
+    @abstractmethod
+    async def set_bot_setting(self, key: str, value: str):
+        ...
+
+    @abstractmethod
+    async def get_bot_start_time(self) -> datetime:
+        ...
+
+    # warnings and sales
+    @abstractmethod
+    async def add_warning(self, user_id: int, admin_id: int, reason: str):
+        ...
+
+    @abstractmethod
+    async def remove_last_warning(self, user_id: int):
+        ...
+
+    @abstractmethod
+    async def save_paid_media_sale(self, media_owner_id: int, buyer_id: int, stars_count: int, payload: str):
+        ...
+
+class SQLiteStorage(Storage):
+    def initialize(self):
+        database.initialize_database()
+
+    def shutdown(self):
+        database.shutdown()
+
+    async def get_user(self, user_id, columns=database.USER_COLUMNS):
+        # Cache hits skip the reader pool round trip
+        return database.cached_user(user_id, columns) or await database.db.get_user(user_id, columns)
+
+    async def create_user(self, user_id, language_code):
+        await database.db.create_user(user_id, language_code)
+
+    async def grant_role(self, user_id, role):
+        await database.db.grant_role(user_id, role)
+
+    async def update_user(self, user_id, updates):
+        await database.db.update_user(user_id, updates)
+
+    async def update_stats(self, user_id):
+        await database.db.update_stats(user_id)
+
+    async def get_active_users(self):
+        return await database.db.get_active_users()
+
+    async def load_active_users(self):
+        await database.db.load_active_users()
+
+    async def mark_unreachable(self, user_ids):
+        await database.db.mark_unreachable(user_ids)
+
+    async def get_admin_users(self):
+        return await database.db.get_admin_users()
+
+    async def get_top_users(self, limit=5):
+        return await database.db.get_top_users(limit)
+
+    async def get_total_users(self):
+        return await database.db.get_total_users()
+
+    async def delete_user_data(self, user_id):
+        await database.db.delete_user_data(user_id)
+
+    def save_delivery(self, message_data):
+        database.save_delivery(message_data)
+
+    async def flush_deliveries(self):
+        await database.db.flush_deliveries()
+
+    async def save_message_map(self, original_message_id, target_user_id, target_message_id):
+        await database.db.save_message_map(original_message_id, target_user_id, target_message_id)
+
+    async def get_message_map(self, original_message_id, target_user_id):
+        return await database.db.get_message_map(original_message_id, target_user_id)
+
+    async def get_message_map_targets(self, original_message_id):
+        return await database.db.get_message_map_targets(original_message_id)
+
+    async def get_delivered_user_ids(self, original_sender_id, original_message_id):
+        return await database.db.get_delivered_user_ids(original_sender_id, original_message_id)
+
+    async def get_original_message_info(self, message_id, user_id):
+        return await database.db.get_original_message_info(message_id, user_id)
+
+    async def get_messages_by_original(self, original_message_id):
+        return await database.db.get_messages_by_original(original_message_id)
+
+    async def get_message_content(self, original_message_id, user_id):
+        return await database.db.get_message_content(original_message_id, user_id)
+
+    async def update_message_content(self, original_message_id, new_content, is_edited=True):
+        await database.db.update_message_content(original_message_id, new_content, is_edited)
+
+    async def delete_messages_by_original(self, original_message_id, exclude_user_id=None):
+        await database.db.delete_messages_by_original(original_message_id, exclude_user_id)
+
+    async def get_original_sender_id(self, original_message_id):
+        return await database.db.get_original_sender_id(original_message_id)
+
+    async def get_total_messages(self):
+        return await database.db.get_total_messages()
+
+    async def pop_expired_messages(self, now, limit=database.CLEANUP_CHUNK):
+        return await database.db.pop_expired_messages(now, limit)
+
+    async def get_next_expiry(self):
+        return await database.db.get_next_expiry()
+
+    async def set_message_expiry(self, sender_id, minutes):
+        await database.db.set_message_expiry(sender_id, minutes)
+
+    async def cleanup_old_data(self, days=30):
+        return await database.db.cleanup_old_data(days)
+
+    async def create_outbox_job(self, original_message_id, sender_id, payload, total, poll_message_id=None):
+        return await database.db.create_outbox_job(original_message_id, sender_id, payload, total, poll_message_id)
+
+    async def update_outbox_progress(self, job_id, sent, failed, status=None):
+        await database.db.update_outbox_progress(job_id, sent, failed, status)
+
+    def checkpoint_outbox(self, job_id, sent, failed, shard=None):
+        # Called from fan-out progress callbacks, so it is queued on the writer without waiting
+        if shard is None:
+            database.writer.submit(database.update_outbox_progress, job_id, sent, failed)
+        else:
+            database.writer.submit(database.update_outbox_shard, job_id, shard, sent, failed)
+
+    async def get_pending_outbox_jobs(self):
+        return await database.db.get_pending_outbox_jobs()
+
+    async def get_shard_outbox_jobs(self, shard):
+        return await database.db.get_shard_outbox_jobs(shard)
+
+    async def update_outbox_shard(self, job_id, shard, sent, failed, status='pending'):
+        await database.db.update_outbox_shard(job_id, shard, sent, failed, status)
+
+    async def finish_outbox_shard(self, job_id, shard, shards, sent, failed):
+        await database.db.finish_outbox_shard(job_id, shard, shards, sent, failed)
+
+    async def cleanup_outbox(self, days=1):
+        return await database.db.cleanup_outbox(days)
+
+    async def create_broadcast(self, creator_id, payload, text, pin, status_chat_id, status_message_id, status_is_caption):
+        return await database.db.create_broadcast(creator_id, payload, text, pin, status_chat_id, status_message_id, status_is_caption)
+
+    async def get_broadcast(self, broadcast_id):
+        return await database.db.get_broadcast(broadcast_id)
+
+    async def update_broadcast(self, broadcast_id, updates):
+        await database.db.update_broadcast(broadcast_id, updates)
+
+    async def get_running_broadcasts(self):
+        return await database.db.get_running_broadcasts()
+
+    async def add_ignored_user(self, user_id, ignored_user_id):
+        await database.db.add_ignored_user(user_id, ignored_user_id)
+
+    async def remove_ignored_user(self, user_id, ignored_user_id):
+        await database.db.remove_ignored_user(user_id, ignored_user_id)
+
+    async def remove_all_ignored(self, user_id):
+        await database.db.remove_all_ignored(user_id)
+
+    async def get_users_ignoring(self, user_id):
+        return await database.db.get_users_ignoring(user_id)
+
+    async def get_daily_stats(self):
+        return await database.db.get_daily_stats()
+
+    async def get_user_daily_stats(self, user_id):
+        return await database.db.get_user_daily_stats(user_id)
+
+    async def get_bot_setting(self, key, default=None):
+        # The main process answers from the settings snapshot without leaving the event loop
+        if database.bot_settings is not None:
+            return database.get_bot_setting(key, default)
+        return await database.db.get_bot_setting(key, default)
+
+    async def set_bot_setting(self, key, value):
+        await database.db.set_bot_setting(key, value)
+
+    async def get_bot_start_time(self):
+        return await database.db.get_bot_start_time()
+
+    async def add_warning(self, user_id, admin_id, reason):
+        await database.db.add_warning(user_id, admin_id, reason)
+
+    async def remove_last_warning(self, user_id):
+        await database.db.remove_last_warning(user_id)
+
+    async def save_paid_media_sale(self, media_owner_id, buyer_id, stars_count, payload):
+        await database.db.save_paid_media_sale(media_owner_id, buyer_id, stars_count, payload)
+
+USER_DEFAULTS = {
+    'language_code': None,
+    'encrypted_name': None,
+    'encrypted_username': None,
+    'tag_enabled': 0,
+    'tag_text': None,
+    'custom_tag': None,
+    'custom_tag_enabled': 0,
+    'admin_tag_enabled': 0,
+    'creator_tag_enabled': 0,
+    'is_admin': 0,
+    'is_creator': 0,
+    'is_coowner': 0,
+    'protect_content': 0,
+    'autodel_time': 0,
+    'banned': 0,
+    'muted_until': None,
+    'warnings': 0,
+    'last_message_text': None,
+    'last_message_time': None,
+    'created_at': None,
+    'last_active': None,
+    'message_count': 0,
+    'captcha_passed': 0,
+    'reachable': 1
+}
+
+class MemoryStorage(Storage):
+    # Everything lives in this process and is lost on restart
+    shared = False
+
+    def __init__(self):
+        self.users: Dict[int, Dict[str, Any]] = {}
+        self.messages: Dict[Tuple[int, int], Dict[str, Any]] = {}
+        self.messages_by_original: Dict[int, Set[Tuple[int, int]]] = {}
+        self.message_maps: Dict[int, Dict[int, Tuple[int, datetime]]] = {}
+        self.expiry_heap: List[Tuple[datetime, int, int]] = []
+        self.ignored: Dict[int, Set[int]] = {}
+        self.ignored_by: Dict[int, Set[int]] = {}
+        self.stats: Dict[str, int] = {}
+        self.user_stats: Dict[Tuple[int, str], int] = {}
+        self.settings: Dict[str, str] = {}
+        self.warnings: List[Dict[str, Any]] = []
+        self.sales: List[Dict[str, Any]] = []
+        self.outbox: Dict[int, Dict[str, Any]] = {}
+        self.outbox_shards: Dict[Tuple[int, int], Dict[str, Any]] = {}
+        self.broadcasts: Dict[int, Dict[str, Any]] = {}
+        self.ids = itertools.count(1)
+
+    def initialize(self):
+        creator_id = int(os.getenv('CREATOR_ID', '8326355672'))
+        if creator_id in self.users:
+            self.users[creator_id]['is_creator'] = 1
+        else:
+            self.insert_user(creator_id, is_creator=1, captcha_passed=1)
+        self.settings.setdefault('bot_start_time', datetime.now().isoformat())
+        logger.info("Storage: in-memory engine")
+
+    def shutdown(self):
+        pass
+
+    def insert_user(self, user_id, **fields):
+        now = datetime.now()
+        self.users[user_id] = dict(USER_DEFAULTS, user_id=user_id, created_at=now, last_active=now, **fields)
+
+    def is_active(self, user):
+        return not user['banned'] and user['captcha_passed'] and user['reachable']
+
+    async def get_user(self, user_id, columns=database.USER_COLUMNS):
+        user = self.users.get(user_id)
+        if not user:
+            return None
+        return database.UserRecord(columns, [user[column] for column in columns])
+
+    async def create_user(self, user_id, language_code):
+        self.insert_user(user_id, language_code=language_code)
+
+    async def grant_role(self, user_id, role):
+        if user_id in self.users:
+            self.users[user_id][role] = 1
+        else:
+            self.insert_user(user_id, **{role: 1})
+
+    async def update_user(self, user_id, updates):
+        if user_id in self.users:
+            self.users[user_id].update(updates)
+
+    async def update_stats(self, user_id):
+        today = datetime.now().strftime('%Y-%m-%d')
+        self.stats[today] = self.stats.get(today, 0) + 1
+        self.user_stats[(user_id, today)] = self.user_stats.get((user_id, today), 0) + 1
+        if user_id in self.users:
+            self.users[user_id]['last_active'] = datetime.now()
+            self.users[user_id]['message_count'] += 1
+
+    async def get_active_users(self):
+        return [user_id for user_id, user in self.users.items() if self.is_active(user)]
+
+    async def load_active_users(self):
+        pass
+
+    async def mark_unreachable(self, user_ids):
+        for user_id in user_ids:
+            if user_id in self.users:
+                self.users[user_id]['reachable'] = 0
+
+    async def get_admin_users(self):
+        return [user_id for user_id, user in self.users.items()
+                if (user['is_admin'] or user['is_creator'] or user['is_coowner']) and not user['banned'] and user['captcha_passed']]
+
+    async def get_top_users(self, limit=5):
+        users = [user for user in self.users.values() if not user['banned'] and user['captcha_passed']]
+        users.sort(key=lambda user: user['message_count'], reverse=True)
+        return [(user['user_id'], user['message_count'], user['encrypted_name'], user['encrypted_username'], user['tag_enabled'],
+                 user['tag_text'], user['custom_tag'], user['custom_tag_enabled']) for user in users[:limit]]
+
+    async def get_total_users(self):
+        return sum(1 for user in self.users.values() if not user['banned'] and user['captcha_passed'])
+
+    async def delete_user_data(self, user_id):
+        self.users.pop(user_id, None)
+        for key in [key for key in self.messages if key[1] == user_id]:
+            self.remove_message(key)
+        for key in [key for key in self.user_stats if key[0] == user_id]:
+            del self.user_stats[key]
+        await self.remove_all_ignored(user_id)
+
+    def remove_message(self, key):
+        message = self.messages.pop(key, None)
+        if message:
+            copies = self.messages_by_original.get(message['original_message_id'])
+            if copies:
+                copies.discard(key)
+                if not copies:
+                    del self.messages_by_original[message['original_message_id']]
+        return message
+
+    def save_delivery(self, message_data):
+        key = (message_data['message_id'], message_data['user_id'])
+        self.remove_message(key)
+        message = dict(message_data, created_at=datetime.now())
+        message.setdefault('is_edited', 0)
+        message.setdefault('edited_at', None)
+        message.setdefault('expires_at', None)
+        self.messages[key] = message
+        self.messages_by_original.setdefault(message['original_message_id'], set()).add(key)
+        if message['expires_at']:
+            heapq.heappush(self.expiry_heap, (message['expires_at'], key[0], key[1]))
+        self.message_maps.setdefault(message['original_message_id'], {})[message['user_id']] = (message['message_id'], datetime.now())
+
+    async def flush_deliveries(self):
+        pass
+
+    async def save_message_map(self, original_message_id, target_user_id, target_message_id):
+        self.message_maps.setdefault(original_message_id, {})[target_user_id] = (target_message_id, datetime.now())
+
+    async def get_message_map(self, original_message_id, target_user_id):
+        target = self.message_maps.get(original_message_id, {}).get(target_user_id)
+        return target[0] if target else None
+
+    async def get_message_map_targets(self, original_message_id):
+        return {target_user_id: target[0] for target_user_id, target in self.message_maps.get(original_message_id, {}).items()}
+
+    async def get_delivered_user_ids(self, original_sender_id, original_message_id):
+        return {message['user_id'] for message in self.copies(original_message_id) if message['original_sender_id'] == original_sender_id}
+
+    async def get_original_message_info(self, message_id, user_id):
+        message = self.messages.get((message_id, user_id))
+        return (message['original_message_id'], message['original_sender_id']) if message else None
+
+    def copies(self, original_message_id):
+        return [self.messages[key] for key in self.messages_by_original.get(original_message_id, ())]
+
+    async def get_messages_by_original(self, original_message_id):
+        return [(message['user_id'], message['message_id'], message['message_type'], message['content'])
+                for message in self.copies(original_message_id)]
+
+    async def get_message_content(self, original_message_id, user_id):
+        for message in self.copies(original_message_id):
+            if message['user_id'] == user_id:
+                return message['content']
+        return None
+
+    async def update_message_content(self, original_message_id, new_content, is_edited=True):
+        for message in self.copies(original_message_id):
+            message['content'] = new_content
+            if is_edited:
+                message['is_edited'] = 1
+                message['edited_at'] = datetime.now()
+
+    async def delete_messages_by_original(self, original_message_id, exclude_user_id=None):
+        for message in self.copies(original_message_id):
+            if not exclude_user_id or message['user_id'] != exclude_user_id:
+                self.remove_message((message['message_id'], message['user_id']))
+        self.message_maps.pop(original_message_id, None)
+
+    async def get_original_sender_id(self, original_message_id):
+        copies = self.copies(original_message_id)
+        return copies[0]['original_sender_id'] if copies else None
+
+    async def get_total_messages(self):
+        return len(self.messages)
+
+    def drop_stale_expiry(self):
+        # Heap entries are not removed when a copy is deleted or rescheduled, so skip ones that no longer match
+        while self.expiry_heap:
+            expires_at, message_id, user_id = self.expiry_heap[0]
+            message = self.messages.get((message_id, user_id))
+            if message and message['expires_at'] == expires_at:
+                return
+            heapq.heappop(self.expiry_heap)
+
+    async def pop_expired_messages(self, now, limit=database.CLEANUP_CHUNK):
+        expired = []
+        map_deleted = 0
+        self.drop_stale_expiry()
+        while self.expiry_heap and self.expiry_heap[0][0] <= now and len(expired) < limit:
+            expires_at, message_id, user_id = heapq.heappop(self.expiry_heap)
+            message = self.remove_message((message_id, user_id))
+            if message:
+                expired.append((user_id, message_id))
+                if self.message_maps.get(message['original_message_id'], {}).pop(user_id, None):
+                    map_deleted += 1
+            self.drop_stale_expiry()
+        return expired, {'messages': len(expired), 'message_map': map_deleted}
+
+    async def get_next_expiry(self):
+        self.drop_stale_expiry()
+        return self.expiry_heap[0][0] if self.expiry_heap else None
+
+    async def set_message_expiry(self, sender_id, minutes):
+        for key, message in self.messages.items():
+            if message['original_sender_id'] != sender_id:
+                continue
+            message['expires_at'] = message['created_at'] + timedelta(minutes=minutes) if minutes else None
+            if message['expires_at']:
+                heapq.heappush(self.expiry_heap, (message['expires_at'], key[0], key[1]))
+
+    async def cleanup_old_data(self, days=30):
+        cutoff = datetime.now() - timedelta(days=days)
+        map_deleted = 0
+        for original_message_id in list(self.message_maps):
+            targets = self.message_maps[original_message_id]
+            for target_user_id in [target_user_id for target_user_id, target in targets.items() if target[1] < cutoff]:
+                del targets[target_user_id]
+                map_deleted += 1
+            if not targets:
+                del self.message_maps[original_message_id]
+        old_messages = [key for key, message in self.messages.items() if message['created_at'] < cutoff]
+        for key in old_messages:
+            self.remove_message(key)
+        old_stats = [date for date in self.stats if date < cutoff.strftime('%Y-%m-%d')]
+        for date in old_stats:
+            del self.stats[date]
+        return {'message_map': map_deleted, 'messages': len(old_messages), 'stats': len(old_stats)}
+
+    async def create_outbox_job(self, original_message_id, sender_id, payload, total, poll_message_id=None):
+        job_id = next(self.ids)
+        self.outbox[job_id] = {
+            'original_message_id': original_message_id, 'sender_id': sender_id, 'payload': payload, 'total': total,
+            'sent': 0, 'failed': 0, 'status': 'pending', 'updated_at': datetime.now(), 'poll_message_id': poll_message_id
+        }
+        return job_id
+
+    async def update_outbox_progress(self, job_id, sent, failed, status=None):
+        if status and status != 'pending':
+            self.outbox.pop(job_id, None)
+            for key in [key for key in self.outbox_shards if key[0] == job_id]:
+                del self.outbox_shards[key]
+            return
+        job = self.outbox.get(job_id)
+        if job:
+            job.update(sent=sent, failed=failed, updated_at=datetime.now())
+            if status:
+                job['status'] = status
+
+    def checkpoint_outbox(self, job_id, sent, failed, shard=None):
+        job = self.outbox.get(job_id)
+        if job:
+            job.update(sent=sent, failed=failed, updated_at=datetime.now())
+
+    async def get_pending_outbox_jobs(self):
+        return [(job_id, job['original_message_id'], job['sender_id'], job['payload'], job['sent'], job['failed'], job['poll_message_id'])
+                for job_id, job in sorted(self.outbox.items()) if job['status'] == 'pending']
+
+    async def get_shard_outbox_jobs(self, shard):
+        jobs = []
+        for job_id, job in sorted(self.outbox.items()):
+            progress = self.outbox_shards.get((job_id, shard), {'sent': 0, 'failed': 0, 'status': 'pending'})
+            if job['status'] == 'pending' and progress['status'] != 'done':
+                jobs.append((job_id, job['original_message_id'], job['sender_id'], job['payload'], progress['sent'], progress['failed'],
+                             job['poll_message_id']))
+        return jobs
+
+    async def update_outbox_shard(self, job_id, shard, sent, failed, status='pending'):
+        self.outbox_shards[(job_id, shard)] = {'sent': sent, 'failed': failed, 'status': status}
+
+    async def finish_outbox_shard(self, job_id, shard, shards, sent, failed):
+        await self.update_outbox_shard(job_id, shard, sent, failed, 'done')
+        done = [progress for (shard_job_id, _), progress in self.outbox_shards.items() if shard_job_id == job_id and progress['status'] == 'done']
+        if len(done) >= shards:
+            await self.update_outbox_progress(job_id, sum(progress['sent'] for progress in done), sum(progress['failed'] for progress in done), 'done')
+
+    async def cleanup_outbox(self, days=1):
+        cutoff = datetime.now() - timedelta(days=days)
+        finished = [job_id for job_id, job in self.outbox.items() if job['status'] != 'pending' and job['updated_at'] < cutoff]
+        for job_id in finished:
+            del self.outbox[job_id]
+        for key in [key for key in self.outbox_shards if key[0] not in self.outbox]:
+            del self.outbox_shards[key]
+        return len(finished)
+
+    async def create_broadcast(self, creator_id, payload, text, pin, status_chat_id, status_message_id, status_is_caption):
+        broadcast_id = next(self.ids)
+        self.broadcasts[broadcast_id] = {
+            'broadcast_id': broadcast_id, 'creator_id': creator_id, 'payload': payload, 'text': text, 'pin': bool(pin),
+            'status': 'running', 'last_user_id': 0, 'sent': 0, 'failed': 0, 'status_chat_id': status_chat_id,
+            'status_message_id': status_message_id, 'status_is_caption': bool(status_is_caption)
+        }
+        return broadcast_id
+
+    async def get_broadcast(self, broadcast_id):
+        broadcast = self.broadcasts.get(broadcast_id)
+        return dict(broadcast) if broadcast else None
+
+    async def update_broadcast(self, broadcast_id, updates):
+        if broadcast_id in self.broadcasts:
+            self.broadcasts[broadcast_id].update(updates)
+
+    async def get_running_broadcasts(self):
+        return sorted(broadcast_id for broadcast_id, broadcast in self.broadcasts.items() if broadcast['status'] == 'running')
+
+    async def add_ignored_user(self, user_id, ignored_user_id):
+        self.ignored.setdefault(user_id, set()).add(ignored_user_id)
+        self.ignored_by.setdefault(ignored_user_id, set()).add(user_id)
+
+    async def remove_ignored_user(self, user_id, ignored_user_id):
+        self.ignored.get(user_id, set()).discard(ignored_user_id)
+        self.ignored_by.get(ignored_user_id, set()).discard(user_id)
+
+    async def remove_all_ignored(self, user_id):
+        for ignored_user_id in self.ignored.pop(user_id, set()):
+            self.ignored_by.get(ignored_user_id, set()).discard(user_id)
+
+    async def get_users_ignoring(self, user_id):
+        return set(self.ignored_by.get(user_id, ()))
+
+    async def get_daily_stats(self):
+        return self.stats.get(datetime.now().strftime('%Y-%m-%d'), 0)
+
+    async def get_user_daily_stats(self, user_id):
+        return self.user_stats.get((user_id, datetime.now().strftime('%Y-%m-%d')), 0)
+
+    async def get_bot_setting(self, key, default=None):
+        return self.settings.get(key, default)
+
+    async def set_bot_setting(self, key, value):
+        self.settings[key] = value
+
+    async def get_bot_start_time(self):
+        if 'bot_start_time' not in self.settings:
+            self.settings['bot_start_time'] = datetime.now().isoformat()
+        return datetime.fromisoformat(self.settings['bot_start_time'])
+
+    async def add_warning(self, user_id, admin_id, reason):
+        self.warnings.append({'id': next(self.ids), 'user_id': user_id, 'admin_id': admin_id, 'reason': reason, 'created_at': datetime.now()})
+
+    async def remove_last_warning(self, user_id):
+        for index in range(len(self.warnings) - 1, -1, -1):
+            if self.warnings[index]['user_id'] == user_id:
+                del self.warnings[index]
+                return
+
+    async def save_paid_media_sale(self, media_owner_id, buyer_id, stars_count, payload):
+        self.sales.append({'media_owner_id': media_owner_id, 'buyer_id': buyer_id, 'stars_count': stars_count,
+                           'payload': payload, 'created_at': datetime.now()})
+
+ENGINES = {
+    'sqlite': SQLiteStorage,
+    'memory': MemoryStorage
+}
+
+db: Storage = SQLiteStorage()
+
+def configure():
+    global db
+    engine = os.getenv('STORAGE_ENGINE', 'sqlite')
+    if engine not in ENGINES:
+        logger.warning(f"Unknown STORAGE_ENGINE {engine}, using sqlite")
+        engine = 'sqlite'
+    if not isinstance(db, ENGINES[engine]):
+        db = ENGINES[engine]()
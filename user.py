@@ -4,14 +4,17 @@ import re
 import os
 import time
 from datetime import datetime, timedelta
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, Tuple
 from difflib import SequenceMatcher
 from aiogram import Bot, types
 from aiogram.enums import ParseMode
 from aiogram.types import FSInputFile, InputPaidMediaPhoto
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 import database
+import storage
 import keyboards
+import delivery
+import expiry
 
 class RateLimiter:
     def __init__(self):
@@ -26,17 +29,28 @@ class RateLimiter:
         self.user_timestamps[user_id] = current_time
         return True
 
-def is_admin(user_id):
-    user = database.get_user(user_id)
-    return bool(user and (user['is_admin'] or user['is_creator'] or user['is_coowner']))
+# Edits of one message are mirrored by one pass at a time, after the user stops editing. Every send
+# uses the latest text; edits made during a pass queue one follow-up for copies that got an older one
+EDIT_DEBOUNCE = 1.0
+latest_edits: Dict[int, Tuple[int, bool, str]] = {}
+edit_tasks: Dict[int, asyncio.Task] = {}
 
-def is_creator(user_id):
-    user = database.get_user(user_id)
-    return bool(user and user['is_creator'])
+# Reactions on one message are collected for a short window and mirrored the same way as edits
+REACTION_WINDOW = 2.0
+latest_reactions: Dict[int, Tuple[int, list]] = {}
+reaction_tasks: Dict[int, asyncio.Task] = {}
 
-def is_coowner(user_id):
-    user = database.get_user(user_id)
-    return bool(user and user['is_coowner'])
+async def is_admin(user_id):
+    user = await storage.db.get_user(user_id, database.USER_PERMISSIONS)
+    return bool(user and (user.is_admin or user.is_creator or user.is_coowner))
+
+async def is_creator(user_id):
+    user = await storage.db.get_user(user_id, database.USER_PERMISSIONS)
+    return bool(user and user.is_creator)
+
+async def is_coowner(user_id):
+    user = await storage.db.get_user(user_id, database.USER_PERMISSIONS)
+    return bool(user and user.is_coowner)
 
 async def send_captcha(message: types.Message, bot: Bot):
     user_id = message.from_user.id
@@ -64,27 +78,27 @@ async def handle_start(message: types.Message, bot: Bot):
     language_code = message.from_user.language_code or 'ru'
     first_name = message.from_user.first_name or ""
     
-    user = database.get_user(user_id)
+    user = await storage.db.get_user(user_id)
     
     if not user:
-        database.cursor.execute('''
-            INSERT INTO users (user_id, language_code, created_at, last_active, captcha_passed)
-            VALUES (?, ?, ?, ?, 0)
-        ''', (user_id, language_code, datetime.now(), datetime.now()))
+        await storage.db.create_user(user_id, language_code)
         await send_captcha(message, bot)
         return
     
-    if not user['captcha_passed']:
+    if not user.captcha_passed:
         await send_captcha(message, bot)
         return
     
+    if not user.reachable:
+        await storage.db.update_user(user_id, {'reachable': 1})
+    
     if first_name:
         encrypted_name = database.encrypt_text(first_name)
-        database.update_user(user_id, {'encrypted_name': encrypted_name})
+        await storage.db.update_user(user_id, {'encrypted_name': encrypted_name})
     
     if message.from_user.username:
         encrypted_username = database.encrypt_text(message.from_user.username)
-        database.update_user(user_id, {'encrypted_username': encrypted_username})
+        await storage.db.update_user(user_id, {'encrypted_username': encrypted_username})
     
     await message.answer("Добро пожаловать!\n\nКанал: @FerumEchoAll\nПомощь с ботом: /help\nУсловия пользования: /privacy\nОстались вопросы? @FerumSupport", 
                          reply_markup=keyboards.create_system_keyboard())
@@ -99,11 +113,11 @@ async def handle_captcha_callback(query: types.CallbackQuery, bot: Bot):
         return
     
     if action == "captcha_correct":
-        database.update_user(user_id, {'captcha_passed': 1})
+        await storage.db.update_user(user_id, {'captcha_passed': 1})
         
-        user = database.get_user(user_id)
-        if user and user['user_id'] == int(os.getenv('CREATOR_ID', '8326355672')):
-            database.update_user(user_id, {'is_creator': 1})
+        user = await storage.db.get_user(user_id)
+        if user and user.user_id == int(os.getenv('CREATOR_ID', '8326355672')):
+            await storage.db.update_user(user_id, {'is_creator': 1})
         
         try:
             await query.message.delete()
@@ -120,8 +134,8 @@ async def handle_captcha_callback(query: types.CallbackQuery, bot: Bot):
         await query.answer("Неправильный выбор! Попробуйте еще раз /start")
 
 async def send_rules(message: types.Message, bot: Bot):
-    user = database.get_user(message.from_user.id)
-    if not user or not user['captcha_passed']:
+    user = await storage.db.get_user(message.from_user.id)
+    if not user or not user.captcha_passed:
         await send_captcha(message, bot)
         return
     
@@ -140,9 +154,9 @@ async def send_rules(message: types.Message, bot: Bot):
 
 async def handle_tag(message: types.Message):
     user_id = message.from_user.id
-    user = database.get_user(user_id)
+    user = await storage.db.get_user(user_id)
     
-    if not user or not user['captcha_passed']:
+    if not user or not user.captcha_passed:
         await send_captcha(message, message.bot)
         return
     
@@ -159,38 +173,38 @@ async def handle_tag(message: types.Message):
             await message.answer("Ставить тэг в виде системных сообщений - мошенничество!", 
                                  reply_markup=keyboards.create_system_keyboard())
             return
-        database.update_user(user_id, {'tag_text': tag_text})
+        await storage.db.update_user(user_id, {'tag_text': tag_text})
         await message.answer(f"{tag_text}, рад знакомству!", reply_markup=keyboards.create_system_keyboard())
         return
     
-    if user and (user['is_creator'] or user['is_admin'] or user['is_coowner']):
+    if user and (user.is_creator or user.is_admin or user.is_coowner):
         builder = InlineKeyboardBuilder()
         
-        tag_status = "✅" if user['tag_enabled'] else "❌"
-        admin_tag_status = "✅" if user['admin_tag_enabled'] else "❌"
-        creator_tag_status = "✅" if user['creator_tag_enabled'] else "❌"
+        tag_status = "✅" if user.tag_enabled else "❌"
+        admin_tag_status = "✅" if user.admin_tag_enabled else "❌"
+        creator_tag_status = "✅" if user.creator_tag_enabled else "❌"
         
         builder.button(text=f"{tag_status} Подпись", callback_data=f"togtag:{user_id}")
         
-        if user['is_admin'] or user['is_coowner']:
+        if user.is_admin or user.is_coowner:
             builder.button(text=f"{admin_tag_status} Метка Админ", callback_data=f"togadmintag:{user_id}")
         
-        if user['is_creator']:
+        if user.is_creator:
             builder.button(text=f"{creator_tag_status} Метка Создатель", callback_data=f"togcreatortag:{user_id}")
         
         builder.adjust(1)
         await message.answer("Настройки тэгов", reply_markup=builder.as_markup())
     else:
-        new_status = 0 if user['tag_enabled'] else 1
-        database.update_user(user_id, {'tag_enabled': new_status})
+        new_status = 0 if user.tag_enabled else 1
+        await storage.db.update_user(user_id, {'tag_enabled': new_status})
         status_text = "Подпись включена" if new_status else "Подпись выключена"
         await message.answer(status_text, reply_markup=keyboards.create_system_keyboard())
 
 async def handle_ctag(message: types.Message):
     user_id = message.from_user.id
-    user = database.get_user(user_id)
+    user = await storage.db.get_user(user_id)
     
-    if not user or not user['captcha_passed']:
+    if not user or not user.captcha_passed:
         await send_captcha(message, message.bot)
         return
     
@@ -208,25 +222,25 @@ async def handle_ctag(message: types.Message):
             await message.answer("Ставить тэг в виде системных сообщений - мошенничество!", 
                                  reply_markup=keyboards.create_system_keyboard())
             return
-        database.update_user(user_id, {'custom_tag': tag_text, 'custom_tag_enabled': 1})
+        await storage.db.update_user(user_id, {'custom_tag': tag_text, 'custom_tag_enabled': 1})
         await message.answer(f"{tag_text}, рад знакомству!", reply_markup=keyboards.create_system_keyboard())
     else:
-        database.update_user(user_id, {'custom_tag_enabled': 0})
+        await storage.db.update_user(user_id, {'custom_tag_enabled': 0})
         await message.answer("Дополнительный тэг удален", reply_markup=keyboards.create_system_keyboard())
 
 async def show_info(message: types.Message):
     user_id = message.from_user.id
-    user = database.get_user(user_id)
+    user = await storage.db.get_user(user_id)
     
-    if not user or not user['captcha_passed']:
+    if not user or not user.captcha_passed:
         await send_captcha(message, message.bot)
         return
     
-    total_users = database.get_total_users()
-    today_messages = database.get_daily_stats()
-    user_today_messages = database.get_user_daily_stats(user_id)
+    total_users = await storage.db.get_total_users()
+    today_messages = await storage.db.get_daily_stats()
+    user_today_messages = await storage.db.get_user_daily_stats(user_id)
     
-    bot_start_time = database.get_bot_start_time()
+    bot_start_time = await storage.db.get_bot_start_time()
     uptime = datetime.now() - bot_start_time
     
     weeks = uptime.days // 7
@@ -256,13 +270,13 @@ async def show_info(message: types.Message):
 
 async def show_top(message: types.Message, bot: Bot):
     user_id = message.from_user.id
-    user = database.get_user(user_id)
+    user = await storage.db.get_user(user_id)
     
-    if not user or not user['captcha_passed']:
+    if not user or not user.captcha_passed:
         await send_captcha(message, bot)
         return
     
-    top_users = database.get_top_users(5)
+    top_users = await storage.db.get_top_users(5)
     
     if not top_users:
         await message.answer("Топ пользователей пуст.", reply_markup=keyboards.create_system_keyboard())
@@ -306,34 +320,34 @@ async def show_top(message: types.Message, bot: Bot):
 
 async def show_profile(message: types.Message, bot: Bot):
     user_id = message.from_user.id
-    user = database.get_user(user_id)
+    user = await storage.db.get_user(user_id)
     
     if not user:
         await send_captcha(message, bot)
         return
     
-    if not user['captcha_passed']:
+    if not user.captcha_passed:
         await send_captcha(message, bot)
         return
 
-    if user['is_creator']:
+    if user.is_creator:
         role = "Создатель"
-    elif user['is_coowner']:
+    elif user.is_coowner:
         role = "Co-Owner"
-    elif user['is_admin']:
+    elif user.is_admin:
         role = "Администратор"
     else:
         role = "Пользователь"
     
     profile_text = f"👤 Ваш профиль:\n\n" \
-                   f"▫️ ID: {user['user_id']}\n" \
+                   f"▫️ ID: {user.user_id}\n" \
                    f"▫️ Роль: {role}\n" \
-                   f"▫️ Тэг: {'✅' if user['tag_enabled'] else '❌'}\n" \
-                   f"▫️ Доп. тег: {user['custom_tag'] if user['custom_tag_enabled'] else '❌'}\n" \
-                   f"▫️ Защита контента: {'✅' if user['protect_content'] else '❌'}\n" \
-                   f"▫️ Автоудаление: {user['autodel_time'] or 0} минут\n" \
-                   f"▫️ Предупреждений: {user['warnings']}\n" \
-                   f"▫️ Сообщений: {user['message_count']}\n"
+                   f"▫️ Тэг: {'✅' if user.tag_enabled else '❌'}\n" \
+                   f"▫️ Доп. тег: {user.custom_tag if user.custom_tag_enabled else '❌'}\n" \
+                   f"▫️ Защита контента: {'✅' if user.protect_content else '❌'}\n" \
+                   f"▫️ Автоудаление: {user.autodel_time or 0} минут\n" \
+                   f"▫️ Предупреждений: {user.warnings}\n" \
+                   f"▫️ Сообщений: {user.message_count}\n"
     
     photo_path = 'data/img/profile.png'
     if os.path.exists(photo_path):
@@ -345,9 +359,9 @@ async def show_profile(message: types.Message, bot: Bot):
 
 async def handle_ignore(message: types.Message):
     user_id = message.from_user.id
-    user = database.get_user(user_id)
+    user = await storage.db.get_user(user_id)
     
-    if not user or not user['captcha_passed']:
+    if not user or not user.captcha_passed:
         await send_captcha(message, message.bot)
         return
     
@@ -358,7 +372,7 @@ async def handle_ignore(message: types.Message):
     
     replied_message_id = message.reply_to_message.message_id
     
-    result = database.get_original_message_info(replied_message_id, user_id)
+    result = await storage.db.get_original_message_info(replied_message_id, user_id)
     
     if not result:
         await message.answer("Не удалось найти автора сообщения!", 
@@ -372,23 +386,22 @@ async def handle_ignore(message: types.Message):
                              reply_markup=keyboards.create_system_keyboard())
         return
     
-    database.add_ignored_user(user_id, ignored_user_id)
+    await storage.db.add_ignored_user(user_id, ignored_user_id)
     await message.answer("Пользователь добавлен в игнор-лист", 
                          reply_markup=keyboards.create_system_keyboard())
 
 async def handle_unignore(message: types.Message):
     user_id = message.from_user.id
-    user = database.get_user(user_id)
+    user = await storage.db.get_user(user_id)
     
-    if not user or not user['captcha_passed']:
+    if not user or not user.captcha_passed:
         await send_captcha(message, message.bot)
         return
     
     args = message.text.split()
     
     if len(args) > 1 and args[1].lower() == "all":
-        database.cursor.execute('DELETE FROM ignored_users WHERE user_id = ?', (user_id,))
-        database.conn.commit()
+        await storage.db.remove_all_ignored(user_id)
         await message.answer("Вы перестали игнорировать всех пользователей", 
                              reply_markup=keyboards.create_system_keyboard())
         return
@@ -400,7 +413,7 @@ async def handle_unignore(message: types.Message):
     
     replied_message_id = message.reply_to_message.message_id
     
-    result = database.get_original_message_info(replied_message_id, user_id)
+    result = await storage.db.get_original_message_info(replied_message_id, user_id)
     
     if not result:
         await message.answer("Не удалось найти автора сообщения!", 
@@ -409,29 +422,29 @@ async def handle_unignore(message: types.Message):
     
     ignored_user_id = result[1]
     
-    database.remove_ignored_user(user_id, ignored_user_id)
+    await storage.db.remove_ignored_user(user_id, ignored_user_id)
     await message.answer("Пользователь удален из игнор-листа", 
                          reply_markup=keyboards.create_system_keyboard())
 
 async def handle_protect(message: types.Message):
     user_id = message.from_user.id
-    user = database.get_user(user_id)
+    user = await storage.db.get_user(user_id)
     
-    if not user or not user['captcha_passed']:
+    if not user or not user.captcha_passed:
         await send_captcha(message, message.bot)
         return
     
-    new_status = 0 if user['protect_content'] else 1
-    database.update_user(user_id, {'protect_content': new_status})
+    new_status = 0 if user.protect_content else 1
+    await storage.db.update_user(user_id, {'protect_content': new_status})
     
     status_text = "✅ Защита контента включена" if new_status else "❌ Защита контента выключена"
     await message.answer(status_text, reply_markup=keyboards.create_system_keyboard())
 
 async def send_privacy(message: types.Message, bot: Bot):
     user_id = message.from_user.id
-    user = database.get_user(user_id)
+    user = await storage.db.get_user(user_id)
     
-    if not user or not user['captcha_passed']:
+    if not user or not user.captcha_passed:
         await send_captcha(message, bot)
         return
     
@@ -454,9 +467,9 @@ async def send_privacy(message: types.Message, bot: Bot):
 
 async def handle_leave(message: types.Message, bot: Bot):
     user_id = message.from_user.id
-    user = database.get_user(user_id)
+    user = await storage.db.get_user(user_id)
     
-    if not user or not user['captcha_passed']:
+    if not user or not user.captcha_passed:
         await send_captcha(message, bot)
         return
     
@@ -486,36 +499,37 @@ async def handle_tag_callback(query: types.CallbackQuery):
         await query.answer("Это не ваши настройки!")
         return
     
-    user = database.get_user(user_id)
+    user = await storage.db.get_user(user_id)
     if not user:
         await query.answer("Пользователь не найден")
         return
     
+    tag_enabled = user.tag_enabled
+    admin_tag_enabled = user.admin_tag_enabled
+    creator_tag_enabled = user.creator_tag_enabled
+    
     if action == "togtag":
-        new_status = 0 if user['tag_enabled'] else 1
-        database.update_user(user_id, {'tag_enabled': new_status})
-        user['tag_enabled'] = new_status
+        tag_enabled = not tag_enabled
+        await storage.db.update_user(user_id, {'tag_enabled': 1 if tag_enabled else 0})
     elif action == "togadmintag":
-        new_status = 0 if user['admin_tag_enabled'] else 1
-        database.update_user(user_id, {'admin_tag_enabled': new_status})
-        user['admin_tag_enabled'] = new_status
+        admin_tag_enabled = not admin_tag_enabled
+        await storage.db.update_user(user_id, {'admin_tag_enabled': 1 if admin_tag_enabled else 0})
     elif action == "togcreatortag":
-        new_status = 0 if user['creator_tag_enabled'] else 1
-        database.update_user(user_id, {'creator_tag_enabled': new_status})
-        user['creator_tag_enabled'] = new_status
+        creator_tag_enabled = not creator_tag_enabled
+        await storage.db.update_user(user_id, {'creator_tag_enabled': 1 if creator_tag_enabled else 0})
     
     builder = InlineKeyboardBuilder()
     
-    tag_status = "✅" if user['tag_enabled'] else "❌"
-    admin_tag_status = "✅" if user['admin_tag_enabled'] else "❌"
-    creator_tag_status = "✅" if user['creator_tag_enabled'] else "❌"
+    tag_status = "✅" if tag_enabled else "❌"
+    admin_tag_status = "✅" if admin_tag_enabled else "❌"
+    creator_tag_status = "✅" if creator_tag_enabled else "❌"
     
     builder.button(text=f"{tag_status} Подпись", callback_data=f"togtag:{user_id}")
     
-    if user['is_admin'] or user['is_coowner']:
+    if user.is_admin or user.is_coowner:
         builder.button(text=f"{admin_tag_status} Метка Админ", callback_data=f"togadmintag:{user_id}")
     
-    if user['is_creator']:
+    if user.is_creator:
         builder.button(text=f"{creator_tag_status} Метка Создатель", callback_data=f"togcreatortag:{user_id}")
     
     builder.adjust(1)
@@ -531,7 +545,9 @@ async def handle_autodel_callback(query: types.CallbackQuery):
     minutes = int(query.data.split("_")[1])
     user_id = query.from_user.id
     
-    database.update_user(user_id, {'autodel_time': minutes})
+    await storage.db.update_user(user_id, {'autodel_time': minutes})
+    await storage.db.set_message_expiry(user_id, minutes)
+    await expiry.scheduler.refresh()
     
     if minutes == 0:
         await query.message.edit_text("Автоудаление выключено")
@@ -549,15 +565,10 @@ async def handle_delete_my_callback(query: types.CallbackQuery, bot: Bot):
         await query.answer("Это не ваше сообщение!")
         return
     
-    messages = database.get_messages_by_original(original_message_id)
+    messages = await storage.db.get_messages_by_original(original_message_id)
     
-    deleted_count = 0
-    for target_user_id, message_id, msg_type, content in messages:
-        try:
-            await bot.delete_message(target_user_id, message_id)
-            deleted_count += 1
-        except:
-            pass
+    deleted_count = await delivery.delete_messages(bot, ((target_user_id, message_id) for target_user_id, message_id, _, _ in messages),
+                                                   f"Delete {original_message_id}")
     
     builder = InlineKeyboardBuilder()
     builder.button(text="SYSTEM", url="https://t.me/FerumEAterms/4")
@@ -569,7 +580,7 @@ async def handle_delete_my_callback(query: types.CallbackQuery, bot: Bot):
     except:
         pass
     
-    database.delete_messages_by_original(original_message_id, sender_id)
+    await storage.db.delete_messages_by_original(original_message_id, sender_id)
     
     await query.answer(f"Сообщение удалено у {deleted_count} пользователей")
 
@@ -587,7 +598,7 @@ async def handle_leave_yes(query: types.CallbackQuery):
         await query.answer("Это не ваши данные!")
         return
     
-    database.delete_user_data(user_id)
+    await storage.db.delete_user_data(user_id)
     
     await query.message.edit_text("Ваши данные успешно удалены. Бот больше не будет вас беспокоить\n\nЕсли захотите вернуться, просто запустите бота командой /start")
     await query.answer()
@@ -596,16 +607,12 @@ async def handle_leave_no(query: types.CallbackQuery):
     await query.message.edit_text("Удаление отменено. Спасибо, что вы с нами")
     await query.answer()
 
-def check_media_type_enabled(media_type: str) -> bool:
-    value = database.get_bot_setting(f'media_{media_type}_enabled', '1')
+async def check_media_type_enabled(media_type: str) -> bool:
+    value = await storage.db.get_bot_setting(f'media_{media_type}_enabled', '1')
     return value != '0'
 
-def check_spam_similarity(user_id, new_message_text):
-    user = database.get_user(user_id)
-    if not user or not user['last_message_text']:
-        return False
-    
-    last_message = user['last_message_text']
+def check_spam_similarity(sender_user: database.UserRecord, new_message_text):
+    last_message = sender_user.last_message_text
     if not last_message or not new_message_text:
         return False
     
@@ -622,15 +629,15 @@ async def send_access_denied(chat_id: int, bot: Bot):
     except Exception as e:
         await bot.send_message(chat_id, "❌ Доступ запрещен!", reply_markup=keyboards.create_system_keyboard())
 
-async def distribute_message(message: types.Message, sender_user: dict, bot: Bot, rate_limiter: RateLimiter):
+async def distribute_message(message: types.Message, sender_user: database.UserRecord, bot: Bot, rate_limiter: RateLimiter):
     user_id = message.from_user.id
     original_message_id = message.message_id
     
-    if sender_user['banned']:
+    if sender_user.banned:
         return
     
-    if sender_user['muted_until']:
-        muted_until = sender_user['muted_until']
+    if sender_user.muted_until:
+        muted_until = sender_user.muted_until
         if datetime.now() < muted_until:
             remaining = muted_until - datetime.now()
             minutes = int(remaining.total_seconds() // 60)
@@ -644,21 +651,21 @@ async def distribute_message(message: types.Message, sender_user: dict, bot: Bot
         return
     
     message_text = message.text or message.caption or ""
-    if message_text and check_spam_similarity(user_id, message_text):
+    if message_text and check_spam_similarity(sender_user, message_text):
         await message.answer("Придумай что-нибудь новое", reply_markup=keyboards.create_system_keyboard())
         return
     
     message_type = message.content_type
-    if not check_media_type_enabled(message_type):
+    if not await check_media_type_enabled(message_type):
         await message.answer("Данный тип сообщений недоступен", reply_markup=keyboards.create_system_keyboard())
         return
     
     if message_text:
-        database.update_user(user_id, {'last_message_text': message_text, 'last_message_time': datetime.now()})
+        await storage.db.update_user(user_id, {'last_message_text': message_text, 'last_message_time': datetime.now()})
     
-    database.update_stats(user_id)
+    await storage.db.update_stats(user_id)
     
-    if (not sender_user['encrypted_name'] or not sender_user['encrypted_username']) and message.from_user:
+    if (not sender_user.encrypted_name or not sender_user.encrypted_username) and message.from_user:
         updates = {}
         if message.from_user.first_name:
             updates['encrypted_name'] = database.encrypt_text(message.from_user.first_name)
@@ -667,21 +674,22 @@ async def distribute_message(message: types.Message, sender_user: dict, bot: Bot
             updates['encrypted_username'] = database.encrypt_text(message.from_user.username)
         
         if updates:
-            database.update_user(user_id, updates)
-            sender_user = database.get_user(user_id)
+            await storage.db.update_user(user_id, updates)
+            sender_user = await storage.db.get_user(user_id, database.USER_SENDER)
     
-    is_paid_media = False
-    paid_stars = 0
-    paid_description = ""
+    await deliver_message(message, sender_user, bot)
+
+async def deliver_message(message: types.Message, sender_user: database.UserRecord, bot: Bot, job_id: Optional[int] = None, sent_before: int = 0, failed_before: int = 0, shard: int = 0, shards: int = 1, poll_message_id: Optional[int] = None):
+    user_id = sender_user.user_id
+    original_message_id = message.message_id
     
-    if message.photo and message.caption and message.caption.startswith('`'):
-        match = re.match(r'`(\d+)\s+(.+)$', message.caption)
-        if match:
-            is_paid_media = True
-            paid_stars = int(match.group(1))
-            paid_description = match.group(2)
+    # Every copy of a message shares one deadline, derived from the message itself so retries and workers agree
+    expires_at = None
+    if sender_user.autodel_time:
+        expires_at = message.date.astimezone().replace(tzinfo=None) + timedelta(minutes=sender_user.autodel_time)
+        expiry.scheduler.schedule(expires_at)
     
-    all_users = database.get_active_users()
+    all_users = await storage.db.get_active_users()
     
     replied_original_id = None
     replied_sender_id = None
@@ -689,228 +697,251 @@ async def distribute_message(message: types.Message, sender_user: dict, bot: Bot
     if message.reply_to_message:
         replied_message_id = message.reply_to_message.message_id
         
-        result = database.get_original_message_info(replied_message_id, user_id)
+        result = await storage.db.get_original_message_info(replied_message_id, user_id)
         
         if result:
             replied_original_id, replied_sender_id = result
     
-    tasks = []
-    for target_user_id in all_users:
-        if target_user_id == user_id:
-            continue
-        
-        if database.is_ignored(target_user_id, user_id):
-            continue
-        
-        task = send_to_user(target_user_id, message, sender_user, original_message_id, is_paid_media, paid_stars, paid_description, False, replied_original_id, replied_sender_id, bot)
-        tasks.append(task)
+    excluded = await storage.db.get_users_ignoring(user_id) | {user_id}
+    targets = [user_id] + [target_user_id for target_user_id in all_users if target_user_id not in excluded]
     
-    sender_task = send_to_user(user_id, message, sender_user, original_message_id, is_paid_media, paid_stars, paid_description, True, replied_original_id, replied_sender_id, bot)
-    tasks.append(sender_task)
+    # Polls are posted to the channel once and forwarded, so every copy shares one set of votes;
+    # resumed jobs reuse the post recorded on the outbox row
+    if message.poll and not job_id:
+        poll_message_id = await post_poll(message, bot)
     
-    results = await asyncio.gather(*tasks, return_exceptions=True)
+    if job_id:
+        delivered = await storage.db.get_delivered_user_ids(user_id, original_message_id)
+        targets = [target_user_id for target_user_id in targets if target_user_id not in delivered]
+    else:
+        job_id = await storage.db.create_outbox_job(original_message_id, user_id, message.model_dump_json(exclude_none=True), len(targets), poll_message_id)
+        if delivery.process_count():
+            return
     
-    for result in results:
-        if isinstance(result, Exception):
-            pass
+    if shards > 1:
+        targets = [target_user_id for target_user_id in targets if target_user_id % shards == shard]
+    
+    def save_progress(fanout):
+        if shards > 1:
+            storage.db.checkpoint_outbox(job_id, sent_before + fanout.sent, failed_before + fanout.failed, shard)
+        else:
+            storage.db.checkpoint_outbox(job_id, sent_before + fanout.sent, failed_before + fanout.failed)
+    
+    reply_targets = await storage.db.get_message_map_targets(replied_original_id) if replied_original_id else {}
+    prepared = PreparedMessage(message, sender_user, bot, replied_original_id, replied_sender_id, expires_at, poll_message_id, reply_targets)
     
-    if message.poll:
-        await handle_poll(message, original_message_id, bot)
+    async def send(target_user_id):
+        return await send_to_user(target_user_id, prepared)
+    
+    fanout = await delivery.scheduler.fanout(targets, send, f"Message {original_message_id}", save_progress, lanes={user_id: 'echo'})
+    await storage.db.flush_deliveries()
+    if shards > 1:
+        await storage.db.finish_outbox_shard(job_id, shard, shards, sent_before + fanout.sent, failed_before + fanout.failed)
+    else:
+        await storage.db.update_outbox_progress(job_id, sent_before + fanout.sent, failed_before + fanout.failed, 'done')
 
-async def send_to_user(target_user_id: int, message: types.Message, sender_user: dict, original_message_id: int, is_paid_media: bool, paid_stars: int, paid_description: str, is_sender: bool, replied_original_id: Optional[int] = None, replied_sender_id: Optional[int] = None, bot: Bot = None):
+async def load_outbox_job(job_id: int, sender_id: int, payload: str, sent: int, failed: int, bot: Bot):
+    sender_user = await storage.db.get_user(sender_id, database.USER_SENDER)
+    
     try:
-        keyboard = keyboards.create_message_keyboard(sender_user, target_user_id, is_sender, is_paid_media, original_message_id)
-        
-        target_reply_to = None
+        message = types.Message.model_validate_json(payload, context={"bot": bot})
+    except Exception as e:
+        message = None
+    
+    if not sender_user or not message:
+        await storage.db.update_outbox_progress(job_id, sent, failed, 'failed')
+        return None, None
+    
+    return message, sender_user
+
+async def resume_pending_deliveries(bot: Bot):
+    if delivery.process_count():
+        await storage.db.cleanup_outbox()
+        return
+    
+    tasks = []
+    for job_id, original_message_id, sender_id, payload, sent, failed, poll_message_id in await storage.db.get_pending_outbox_jobs():
+        message, sender_user = await load_outbox_job(job_id, sender_id, payload, sent, failed, bot)
+        if message:
+            tasks.append(deliver_message(message, sender_user, bot, job_id, sent, failed, poll_message_id=poll_message_id))
+    
+    await asyncio.gather(*tasks, return_exceptions=True)
+    await storage.db.cleanup_outbox()
+
+class PreparedMessage:
+    # Everything that is the same for all recipients is resolved once per message
+    def __init__(self, message: types.Message, sender_user: database.UserRecord, bot: Bot, replied_original_id: Optional[int] = None,
+                 replied_sender_id: Optional[int] = None, expires_at: Optional[datetime] = None, poll_message_id: Optional[int] = None,
+                 reply_targets: Optional[Dict[int, int]] = None):
+        self.message = message
+        self.sender_user = sender_user
+        self.sender_id = sender_user.user_id
+        self.original_message_id = message.message_id
+        self.bot = bot
+        self.replied_original_id = replied_original_id
+        self.replied_sender_id = replied_sender_id
+        self.reply_targets = reply_targets or {}
+        self.poll_message_id = poll_message_id
+        self.protect_content = sender_user.protect_content
         
-        if replied_original_id:
-            target_reply_to = database.get_message_map(replied_original_id, target_user_id)
+        self.is_paid_media = False
+        self.paid_stars = 0
+        self.paid_description = ""
+        if message.photo and message.caption and message.caption.startswith('`'):
+            match = re.match(r'`(\d+)\s+(.+)$', message.caption)
+            if match:
+                self.is_paid_media = True
+                self.paid_stars = int(match.group(1))
+                self.paid_description = match.group(2)
         
-        need_reply_tag = False
-        if replied_original_id and target_user_id == replied_sender_id and target_user_id != sender_user['user_id']:
-            need_reply_tag = True
+        sender_keyboard = keyboards.create_message_keyboard(sender_user, self.sender_id, True, self.is_paid_media, self.original_message_id)
+        recipient_keyboard = keyboards.create_message_keyboard(sender_user, None, False, self.is_paid_media, self.original_message_id)
+        self.sender_markup = sender_keyboard.as_markup() if sender_keyboard else None
+        self.recipient_markup = recipient_keyboard.as_markup() if recipient_keyboard else None
         
-        if is_paid_media and message.photo:
-            sent_message = await bot.send_paid_media(
-                chat_id=target_user_id,
-                star_count=paid_stars,
-                media=[InputPaidMediaPhoto(media=message.photo[-1].file_id)],
-                caption=paid_description,
-                payload=f"{sender_user['user_id']}_{original_message_id}"
-            )
-            
-            if keyboard:
-                try:
-                    await sent_message.edit_reply_markup(reply_markup=keyboard.as_markup())
-                except:
-                    pass
-        else:
-            sent_message = await send_message_copy(target_user_id, message, sender_user, target_reply_to, keyboard, need_reply_tag, bot)
+        self.method, self.text_field, self.text, self.params = self.resolve_method()
+        self.use_markup = not message.poll
         
-        if sent_message:
-            message_data = {
-                'message_id': sent_message.message_id,
-                'user_id': target_user_id,
-                'original_message_id': original_message_id,
-                'original_sender_id': sender_user['user_id'],
-                'message_type': message.content_type,
-                'content': message.text or message.caption or '',
-                'tag_enabled': 1 if sender_user['tag_enabled'] else 0,
-                'tag_text': sender_user['tag_text'],
-                'custom_tag': sender_user['custom_tag'],
-                'custom_tag_enabled': 1 if sender_user['custom_tag_enabled'] else 0,
-                'admin_tag': 1 if sender_user['admin_tag_enabled'] else 0,
-                'creator_tag': 1 if sender_user['creator_tag_enabled'] else 0,
-                'coowner_tag': 1 if sender_user['is_coowner'] else 0,
-                'protect_content': 1 if sender_user['protect_content'] else 0,
-                'paid_media': 1 if is_paid_media else 0,
-                'paid_stars': paid_stars if is_paid_media else 0,
-                'is_reply': 1 if target_reply_to else 0,
-                'reply_to_message_id': target_reply_to,
-                'is_edited': 0,
-                'edited_at': None
-            }
-            
-            database.save_message(message_data)
-            
-            database.save_message_map(original_message_id, target_user_id, sent_message.message_id)
-            
-    except Exception as e:
-        pass
-
-async def send_message_copy(target_user_id: int, message: types.Message, sender_user: dict, reply_to: Optional[int], keyboard, need_reply_tag: bool = False, bot: Bot = None):
-    protect_content = sender_user['protect_content']
-    
-    try:
-        if need_reply_tag:
-            caption_prefix = "#REPLY\n"
-        else:
-            caption_prefix = ""
+        self.message_data = {
+            'original_message_id': self.original_message_id,
+            'original_sender_id': self.sender_id,
+            'message_type': message.content_type,
+            'content': message.text or message.caption or '',
+            'tag_enabled': 1 if sender_user.tag_enabled else 0,
+            'tag_text': sender_user.tag_text,
+            'custom_tag': sender_user.custom_tag,
+            'custom_tag_enabled': 1 if sender_user.custom_tag_enabled else 0,
+            'admin_tag': 1 if sender_user.admin_tag_enabled else 0,
+            'creator_tag': 1 if sender_user.creator_tag_enabled else 0,
+            'coowner_tag': 1 if sender_user.is_coowner else 0,
+            'protect_content': 1 if sender_user.protect_content else 0,
+            'paid_media': 1 if self.is_paid_media else 0,
+            'paid_stars': self.paid_stars if self.is_paid_media else 0,
+            'is_edited': 0,
+            'edited_at': None,
+            'expires_at': expires_at
+        }
+    
+    def resolve_method(self):
+        message = self.message
+        bot = self.bot
+        caption = message.caption or ''
         
         if message.text:
-            text = f"{caption_prefix}{message.text}"
-            return await bot.send_message(
-                target_user_id,
-                text,
-                parse_mode=ParseMode.MARKDOWN,
-                reply_to_message_id=reply_to,
-                reply_markup=keyboard.as_markup() if keyboard else None,
-                protect_content=protect_content
-            )
+            return bot.send_message, 'text', message.text, {'parse_mode': ParseMode.MARKDOWN}
         elif message.photo:
-            caption = f"{caption_prefix}{message.caption or ''}"
-            return await bot.send_photo(
-                target_user_id,
-                message.photo[-1].file_id,
-                caption=caption,
-                parse_mode=ParseMode.MARKDOWN,
-                reply_to_message_id=reply_to,
-                reply_markup=keyboard.as_markup() if keyboard else None,
-                protect_content=protect_content
-            )
+            return bot.send_photo, 'caption', caption, {'photo': message.photo[-1].file_id, 'parse_mode': ParseMode.MARKDOWN}
         elif message.video:
-            caption = f"{caption_prefix}{message.caption or ''}"
-            return await bot.send_video(
-                target_user_id,
-                message.video.file_id,
-                caption=caption,
-                parse_mode=ParseMode.MARKDOWN,
-                reply_to_message_id=reply_to,
-                reply_markup=keyboard.as_markup() if keyboard else None,
-                protect_content=protect_content
-            )
+            return bot.send_video, 'caption', caption, {'video': message.video.file_id, 'parse_mode': ParseMode.MARKDOWN}
         elif message.sticker:
-            return await bot.send_sticker(
-                target_user_id,
-                message.sticker.file_id,
-                reply_to_message_id=reply_to,
-                reply_markup=keyboard.as_markup() if keyboard else None,
-                protect_content=protect_content
-            )
+            return bot.send_sticker, None, None, {'sticker': message.sticker.file_id}
         elif message.animation:
-            caption = f"{caption_prefix}{message.caption or ''}"
-            return await bot.send_animation(
-                target_user_id,
-                message.animation.file_id,
-                caption=caption,
-                parse_mode=ParseMode.MARKDOWN,
-                reply_to_message_id=reply_to,
-                reply_markup=keyboard.as_markup() if keyboard else None,
-                protect_content=protect_content
-            )
+            return bot.send_animation, 'caption', caption, {'animation': message.animation.file_id, 'parse_mode': ParseMode.MARKDOWN}
         elif message.document:
-            caption = f"{caption_prefix}{message.caption or ''}"
-            return await bot.send_document(
-                target_user_id,
-                message.document.file_id,
-                caption=caption,
-                parse_mode=ParseMode.MARKDOWN,
-                reply_to_message_id=reply_to,
-                reply_markup=keyboard.as_markup() if keyboard else None,
-                protect_content=protect_content
-            )
+            return bot.send_document, 'caption', caption, {'document': message.document.file_id, 'parse_mode': ParseMode.MARKDOWN}
         elif message.voice:
-            caption = f"{caption_prefix}{message.caption or ''}"
-            return await bot.send_voice(
-                target_user_id,
-                message.voice.file_id,
-                caption=caption,
-                parse_mode=ParseMode.MARKDOWN,
-                reply_to_message_id=reply_to,
-                reply_markup=keyboard.as_markup() if keyboard else None,
-                protect_content=protect_content
-            )
+            return bot.send_voice, 'caption', caption, {'voice': message.voice.file_id, 'parse_mode': ParseMode.MARKDOWN}
         elif message.poll:
-            return await bot.send_poll(
-                target_user_id,
-                question=message.poll.question,
-                options=[option.text for option in message.poll.options],
-                is_anonymous=message.poll.is_anonymous,
-                allows_multiple_answers=message.poll.allows_multiple_answers,
-                explanation=message.poll.explanation,
-                open_period=message.poll.open_period,
-                close_date=message.poll.close_date,
-                reply_to_message_id=reply_to,
-                protect_content=protect_content
-            )
+            return bot.send_poll, None, None, {
+                'question': message.poll.question,
+                'options': [option.text for option in message.poll.options],
+                'is_anonymous': message.poll.is_anonymous,
+                'allows_multiple_answers': message.poll.allows_multiple_answers,
+                'explanation': message.poll.explanation,
+                'open_period': message.poll.open_period,
+                'close_date': message.poll.close_date
+            }
         elif message.contact:
-            return await bot.send_contact(
-                target_user_id,
-                phone_number=message.contact.phone_number,
-                first_name=message.contact.first_name,
-                last_name=message.contact.last_name,
-                reply_to_message_id=reply_to,
-                reply_markup=keyboard.as_markup() if keyboard else None,
-                protect_content=protect_content
-            )
+            return bot.send_contact, None, None, {
+                'phone_number': message.contact.phone_number,
+                'first_name': message.contact.first_name,
+                'last_name': message.contact.last_name
+            }
         elif message.location:
-            return await bot.send_location(
-                target_user_id,
-                latitude=message.location.latitude,
-                longitude=message.location.longitude,
-                reply_to_message_id=reply_to,
-                reply_markup=keyboard.as_markup() if keyboard else None,
-                protect_content=protect_content
-            )
+            return bot.send_location, None, None, {
+                'latitude': message.location.latitude,
+                'longitude': message.location.longitude
+            }
         elif message.venue:
-            return await bot.send_venue(
-                target_user_id,
-                latitude=message.venue.location.latitude,
-                longitude=message.venue.location.longitude,
-                title=message.venue.title,
-                address=message.venue.address,
-                reply_to_message_id=reply_to,
-                reply_markup=keyboard.as_markup() if keyboard else None,
-                protect_content=protect_content
+            return bot.send_venue, None, None, {
+                'latitude': message.venue.location.latitude,
+                'longitude': message.venue.location.longitude,
+                'title': message.venue.title,
+                'address': message.venue.address
+            }
+        return None, None, None, {}
+    
+    async def send(self, target_user_id: int, reply_to: Optional[int] = None, need_reply_tag: bool = False):
+        markup = self.sender_markup if target_user_id == self.sender_id else self.recipient_markup
+        
+        if self.is_paid_media:
+            sent_message = await self.bot.send_paid_media(
+                chat_id=target_user_id,
+                star_count=self.paid_stars,
+                media=[InputPaidMediaPhoto(media=self.message.photo[-1].file_id)],
+                caption=self.paid_description,
+                payload=f"{self.sender_id}_{self.original_message_id}"
             )
-    except Exception as e:
-        return None
+            
+            if markup:
+                try:
+                    await sent_message.edit_reply_markup(reply_markup=markup)
+                except:
+                    pass
+            return sent_message
+        
+        if self.poll_message_id:
+            return await self.bot.forward_message(
+                chat_id=target_user_id,
+                from_chat_id=poll_channel_id(),
+                message_id=self.poll_message_id,
+                protect_content=self.protect_content
+            )
+        
+        if not self.method:
+            return None
+        
+        params = dict(self.params)
+        if self.text_field:
+            params[self.text_field] = f"#REPLY\n{self.text}" if need_reply_tag else self.text
+        if self.use_markup:
+            params['reply_markup'] = markup
+        
+        return await self.method(
+            target_user_id,
+            reply_to_message_id=reply_to,
+            protect_content=self.protect_content,
+            **params
+        )
 
-async def handle_poll(message: types.Message, original_message_id: int, bot: Bot):
+async def send_to_user(target_user_id: int, prepared: PreparedMessage):
+    target_reply_to = prepared.reply_targets.get(target_user_id)
+    
+    need_reply_tag = False
+    if prepared.replied_original_id and target_user_id == prepared.replied_sender_id and target_user_id != prepared.sender_id:
+        need_reply_tag = True
+    
+    sent_message = await prepared.send(target_user_id, target_reply_to, need_reply_tag)
+    
+    if sent_message:
+        message_data = dict(prepared.message_data)
+        message_data['message_id'] = sent_message.message_id
+        message_data['user_id'] = target_user_id
+        message_data['is_reply'] = 1 if target_reply_to else 0
+        message_data['reply_to_message_id'] = target_reply_to
+        
+        storage.db.save_delivery(message_data)
+        return True
+        
+    return False
+
+def poll_channel_id():
+    return int(os.getenv('POLL_CHANNEL_ID', '-1003584966418'))
+
+async def post_poll(message: types.Message, bot: Bot):
     try:
-        POLL_CHANNEL_ID = int(os.getenv('POLL_CHANNEL_ID', '-1003584966418'))
         sent_poll = await bot.send_poll(
-            chat_id=POLL_CHANNEL_ID,
+            chat_id=poll_channel_id(),
             question=message.poll.question,
             options=[option.text for option in message.poll.options],
             is_anonymous=message.poll.is_anonymous,
@@ -919,51 +950,38 @@ async def handle_poll(message: types.Message, original_message_id: int, bot: Bot
             open_period=message.poll.open_period,
             close_date=message.poll.close_date,
         )
-        
-        all_users = database.get_active_users()
-        
-        for user_id in all_users:
-            try:
-                forwarded = await bot.forward_message(
-                    chat_id=user_id,
-                    from_chat_id=POLL_CHANNEL_ID,
-                    message_id=sent_poll.message_id
-                )
-                
-                database.save_message_map(original_message_id, user_id, forwarded.message_id)
-            except:
-                pass
-        
     except Exception as e:
-        pass
+        return None
+    
+    return sent_poll.message_id
 
 async def handle_message(message: types.Message, bot: Bot, rate_limiter: RateLimiter):
     if message.text and message.text.startswith('/'):
         return
     
     user_id = message.from_user.id
-    user = database.get_user(user_id)
+    user = await storage.db.get_user(user_id, database.USER_GATE)
     
     if not user:
         await send_captcha(message, bot)
         return
     
-    if not user['captcha_passed']:
+    if not user.captcha_passed:
         await send_captcha(message, bot)
         return
     
-    bot_enabled = database.get_bot_setting('bot_enabled', '1')
-    if bot_enabled == '0' and not is_admin(user_id):
+    bot_enabled = await storage.db.get_bot_setting('bot_enabled', '1')
+    if bot_enabled == '0' and not await is_admin(user_id):
         await message.answer("Бот временно отключен", reply_markup=keyboards.create_system_keyboard())
         return
     
-    if user['banned']:
+    if user.banned:
         await message.answer("Вы не можете отправлять сообщения, так как ваш аккаунт заблокирован в боте\n\nПравила: /rules", 
                              reply_markup=keyboards.create_system_keyboard())
         return
     
-    if user['muted_until']:
-        muted_until = user['muted_until']
+    if user.muted_until:
+        muted_until = user.muted_until
         if datetime.now() < muted_until:
             remaining = muted_until - datetime.now()
             minutes = int(remaining.total_seconds() // 60)
@@ -972,7 +990,7 @@ async def handle_message(message: types.Message, bot: Bot, rate_limiter: RateLim
             return
     
     message_type = message.content_type
-    if not check_media_type_enabled(message_type):
+    if not await check_media_type_enabled(message_type):
         await message.answer("Данный тип сообщения отключен", reply_markup=keyboards.create_system_keyboard())
         return
     
@@ -981,15 +999,13 @@ async def handle_message(message: types.Message, bot: Bot, rate_limiter: RateLim
 async def handle_message_edit(message: types.Message, bot: Bot):
     user_id = message.from_user.id
     
-    result = database.get_original_message_info(message.message_id, user_id)
+    result = await storage.db.get_original_message_info(message.message_id, user_id)
     
     if not result:
         return
     
     original_message_id, original_sender_id = result
     
-    messages = database.get_messages_by_original(original_message_id)
-    
     new_content = message.text or message.caption or ''
     if not new_content:
         return
@@ -997,54 +1013,99 @@ async def handle_message_edit(message: types.Message, bot: Bot):
     edited_mark = "\n\n✏️ (edited message)"
     full_content = new_content + edited_mark
     
-    database.update_message_content(original_message_id, full_content, is_edited=True)
+    await storage.db.update_message_content(original_message_id, full_content, is_edited=True)
     
-    edited_count = 0
-    for target_user_id, msg_id, msg_type, old_content in messages:
-        try:
-            if message.text and msg_type == 'text':
-                await bot.edit_message_text(
-                    chat_id=target_user_id,
-                    message_id=msg_id,
-                    text=full_content,
-                    parse_mode=ParseMode.MARKDOWN
-                )
-                edited_count += 1
-            elif message.caption and msg_type in ['photo', 'video', 'document', 'animation', 'voice']:
-                await bot.edit_message_caption(
-                    chat_id=target_user_id,
-                    message_id=msg_id,
-                    caption=full_content,
-                    parse_mode=ParseMode.MARKDOWN
-                )
-                edited_count += 1
-        except Exception as e:
-            continue
-    
-    return edited_count
+    previous = latest_edits.get(original_message_id)
+    latest_edits[original_message_id] = (previous[0] + 1 if previous else 1, bool(message.text), full_content)
+    if original_message_id not in edit_tasks:
+        edit_tasks[original_message_id] = asyncio.create_task(propagate_edit(original_message_id, bot))
+
+async def propagate_edit(original_message_id: int, bot: Bot):
+    sent_versions: Dict[int, int] = {}
+    try:
+        while True:
+            await asyncio.sleep(EDIT_DEBOUNCE)
+            version, is_text, _ = latest_edits[original_message_id]
+            
+            copies = {}
+            for target_user_id, msg_id, msg_type, old_content in await storage.db.get_messages_by_original(original_message_id):
+                if sent_versions.get(target_user_id) == version:
+                    continue
+                if is_text and msg_type == 'text':
+                    copies[target_user_id] = (msg_id, False)
+                elif not is_text and msg_type in ['photo', 'video', 'document', 'animation', 'voice']:
+                    copies[target_user_id] = (msg_id, True)
+            
+            async def edit(target_user_id):
+                msg_id, is_caption = copies[target_user_id]
+                current_version, _, full_content = latest_edits[original_message_id]
+                if is_caption:
+                    await bot.edit_message_caption(
+                        chat_id=target_user_id,
+                        message_id=msg_id,
+                        caption=full_content,
+                        parse_mode=ParseMode.MARKDOWN
+                    )
+                else:
+                    await bot.edit_message_text(
+                        chat_id=target_user_id,
+                        message_id=msg_id,
+                        text=full_content,
+                        parse_mode=ParseMode.MARKDOWN
+                    )
+                sent_versions[target_user_id] = current_version
+                return True
+            
+            await delivery.scheduler.fanout(copies, edit, f"Edit {original_message_id}")
+            if latest_edits[original_message_id][0] == version:
+                break
+    finally:
+        edit_tasks.pop(original_message_id, None)
+        latest_edits.pop(original_message_id, None)
 
 async def handle_message_reaction(reaction: types.MessageReactionUpdated, bot: Bot):
     user_id = reaction.user.id
     message_id = reaction.message_id
     
-    result = database.get_original_message_info(message_id, user_id)
+    result = await storage.db.get_original_message_info(message_id, user_id)
     
     if not result:
         return
     
     original_message_id, original_sender_id = result
     
-    messages = database.get_messages_by_original(original_message_id)
-    
-    for target_user_id, target_message_id, _, _ in messages:
-        try:
-            await bot.set_message_reaction(
-                chat_id=target_user_id,
-                message_id=target_message_id,
-                reaction=reaction.new_reaction
-            )
-        except Exception as e:
-            pass
+    # A running pass picks the new state up; otherwise a pass is started
+    previous = latest_reactions.get(original_message_id)
+    latest_reactions[original_message_id] = (previous[0] + 1 if previous else 1, reaction.new_reaction)
+    if original_message_id not in reaction_tasks:
+        reaction_tasks[original_message_id] = asyncio.create_task(propagate_reaction(original_message_id, bot))
+
+async def propagate_reaction(original_message_id: int, bot: Bot):
+    sent_versions: Dict[int, int] = {}
+    try:
+        while True:
+            await asyncio.sleep(REACTION_WINDOW)
+            version = latest_reactions[original_message_id][0]
+            
+            copies = {target_user_id: target_message_id for target_user_id, target_message_id, _, _ in await storage.db.get_messages_by_original(original_message_id)
+                      if sent_versions.get(target_user_id) != version}
+            
+            async def set_reaction(target_user_id):
+                current_version, new_reaction = latest_reactions[original_message_id]
+                await bot.set_message_reaction(
+                    chat_id=target_user_id,
+                    message_id=copies[target_user_id],
+                    reaction=new_reaction
+                )
+                sent_versions[target_user_id] = current_version
+                return True
+            
+            await delivery.scheduler.fanout(copies, set_reaction, f"Reaction {original_message_id}")
+            if latest_reactions[original_message_id][0] == version:
+                break
+    finally:
+        reaction_tasks.pop(original_message_id, None)
+        latest_reactions.pop(original_message_id, None)
 
 async def handle_paid_media_purchase(message: types.Message, bot: Bot):
     try:
@@ -1062,7 +1123,7 @@ async def handle_paid_media_purchase(message: types.Message, bot: Bot):
         media_owner_id = int(parts[0])
         original_message_id = int(parts[1])
         
-        database.save_paid_media_sale(media_owner_id, message.from_user.id, message.paid_media_purchased.star_count, payload)
+        await storage.db.save_paid_media_sale(media_owner_id, message.from_user.id, message.paid_media_purchased.star_count, payload)
         
         notification_text = f"✅ Ваше платное медиа было куплено!\n\n⭐ Звезд получено: {message.paid_media_purchased.star_count}\n\nДля получения выплаты обратитесь в поддержку - @FerumSupport"
         
@@ -0,0 +1,84 @@
+import asyncio
+import os
+import sys
+import signal
+import logging
+from dotenv import load_dotenv
+from aiogram import Bot
+import database
+import storage
+import delivery
+import user
+
+load_dotenv()
+
+async def run_worker(shard: int, shards: int):
+    logger = logging.getLogger(f"worker-{shard}")
+    database.configure()
+    bot = Bot(token=os.getenv('token'))
+    bot.session.middleware(delivery.LaneMiddleware())
+    delivery.scheduler.start(share=delivery.worker_share(shards))
+
+    in_progress = set()
+    tasks = set()
+
+    async def run_job(job_id, message, sender_user, sent, failed, poll_message_id):
+        try:
+            await user.deliver_message(message, sender_user, bot, job_id, sent, failed, shard, shards, poll_message_id)
+        except Exception as e:
+            logger.error(f"Job {job_id} failed: {e}")
+        finally:
+            in_progress.discard(job_id)
+
+    logger.info(f"Delivery worker {shard + 1}/{shards} started")
+    try:
+        while True:
+            for job_id, original_message_id, sender_id, payload, sent, failed, poll_message_id in await storage.db.get_shard_outbox_jobs(shard):
+                if job_id in in_progress:
+                    continue
+
+                message, sender_user = await user.load_outbox_job(job_id, sender_id, payload, sent, failed, bot)
+                if not message:
+                    continue
+
+                in_progress.add(job_id)
+                task = asyncio.create_task(run_job(job_id, message, sender_user, sent, failed, poll_message_id))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+
+            await asyncio.sleep(0.2)
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await delivery.scheduler.stop()
+        storage.db.shutdown()
+        await bot.session.close()
+        logger.info(f"Delivery worker {shard + 1}/{shards} stopped")
+
+async def main(shard: int, shards: int):
+    worker_task = asyncio.create_task(run_worker(shard, shards))
+    asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, worker_task.cancel)
+    try:
+        await worker_task
+    except asyncio.CancelledError:
+        pass
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+        handlers=[
+            logging.FileHandler('bot.log'),
+            logging.StreamHandler(sys.stdout)
+        ]
+    )
+
+    if len(sys.argv) != 3 or not os.getenv('token'):
+        logging.error("Usage: python worker.py <shard> <shards> (token must be set in .env)")
+        sys.exit(1)
+
+    try:
+        asyncio.run(main(int(sys.argv[1]), int(sys.argv[2])))
+    except KeyboardInterrupt:
+        pass